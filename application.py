@@ -0,0 +1,94 @@
+"""The application factory.
+
+create_app() builds a configured app with every extension and blueprint
+attached. It does not connect to the database or start threads, so a
+preloading server (``gunicorn --preload wsgi:app``) can build and warm the
+app once in its parent and fork workers that share it. Each forked worker
+drops the connection pools it inherited and opens its own connections.
+"""
+import os
+import weakref
+
+from flask import Flask
+from jinja2 import FileSystemBytecodeCache
+from sqlalchemy import event
+
+from cache import TTLCache, make_cache
+from extensions import (assets, db, engine_options, login_manager, mailer, metrics, password_hasher, payments,
+                        query_stats, sqlite_connection_configurer)
+
+# Engines of every app built in this process. A forked child drops the pooled
+# connections it inherited, without closing them under the parent's feet.
+# The set holds weak references, so it never keeps an app's engines alive.
+_forked_engines = weakref.WeakSet()
+
+def _dispose_forked_engines():
+    for engine in list(_forked_engines):
+        engine.dispose(close=False)
+
+# os.register_at_fork only exists on POSIX; Windows cannot fork anyway.
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_dispose_forked_engines)
+
+
+def create_app(config=None):
+    """Create the app from config.py, with ``config`` (a mapping) applied on top."""
+    app = Flask(__name__)
+    app.config.from_pyfile('config.py')
+    if config:
+        app.config.update(config)
+
+    # Pool settings depend on the database URLs, so they are worked out from
+    # the final config rather than in config.py. Explicit settings win.
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS',
+                          engine_options(app.config['SQLALCHEMY_DATABASE_URI'], app.config))
+    replica_url = app.config['DATABASE_REPLICA_URL']
+    if replica_url:
+        binds = app.config['SQLALCHEMY_BINDS'] = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+        binds.setdefault('replica', dict(url=replica_url, **engine_options(replica_url, app.config)))
+
+    # Compiled templates are cached on disk so that new worker processes load
+    # bytecode instead of parsing and compiling every template again.
+    if app.config['JINJA_BYTECODE_CACHE_DIR']:
+        bytecode_dir = os.path.join(app.instance_path, app.config['JINJA_BYTECODE_CACHE_DIR'])
+        os.makedirs(bytecode_dir, exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(bytecode_dir)
+
+    db.init_app(app)
+    login_manager.init_app(app)
+    password_hasher.init_app(app)
+    payments.init_app(app)
+    mailer.init_app(app)
+    query_stats.init_app(app)
+    metrics.init_app(app)
+    assets.init_app(app)
+
+    app.extensions['user_cache'] = TTLCache(maxsize=app.config['USER_CACHE_SIZE'], ttl=app.config['USER_CACHE_TTL'])
+    app.extensions['catalog_cache'] = make_cache(
+        app.config['CATALOG_CACHE_BACKEND'], app.config['CATALOG_CACHE_SIZE'], app.config['CATALOG_CACHE_TTL'],
+        os.path.join(app.instance_path, app.config['CATALOG_CACHE_PATH']))
+
+    configure_sqlite_connection = sqlite_connection_configurer(app.config['SQLITE_PRAGMAS'])
+    with app.app_context():
+        for bind_key, engine in db.engines.items():
+            event.listen(engine, 'connect', configure_sqlite_connection)
+            metrics.instrument_engine(bind_key or 'primary', engine)
+            query_stats.instrument_engine(engine, app.config)
+            _forked_engines.add(engine)
+        metrics.track_cache('user', app.extensions['user_cache'])
+        metrics.track_cache('catalog', app.extensions['catalog_cache'])
+
+    from views import auth, cart, catalog, inventory, orders, outbox, payments as payment_views
+    for blueprint in (catalog.bp, auth.bp, cart.bp, orders.bp, payment_views.bp, inventory.bp, outbox.bp):
+        app.register_blueprint(blueprint)
+
+    # Done here, so a preloading server compiles once in the parent and
+    # every forked worker starts with the templates already in memory.
+    if app.config['JINJA_PRECOMPILE']:
+        precompile_templates(app)
+    return app
+
+def precompile_templates(app):
+    """Load every template so the first request does not pay to compile it."""
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
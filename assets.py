@@ -0,0 +1,163 @@
+"""Fingerprinted, precompressed static assets.
+
+``flask --app main assets build`` copies every file under the static folder
+to ``dist/`` with a content hash in its name, writes gzip (and, when the
+``brotli`` package is installed, brotli) variants of text files next to it,
+and records the mapping in ``dist/manifest.json``. With a manifest present,
+``url_for('static', filename='styles.css')`` returns the hashed name, and
+hashed files are served with ``Cache-Control: immutable``, as brotli or gzip
+when the browser accepts it. Without one, static files are served as usual.
+
+Builds never delete earlier hashed files, so pages rendered or cached before
+a rebuild keep loading the assets they reference.
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+import shutil
+
+import click
+from flask import current_app, request, send_from_directory
+from flask.cli import AppGroup
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'image/svg+xml')
+# Preferred first when the browser accepts several.
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def fingerprint(path, data):
+    """Return ``path`` with a hash of ``data`` before its extension."""
+    root, extension = posixpath.splitext(path)
+    return '%s.%s%s' % (root, hashlib.sha256(data).hexdigest()[:12], extension)
+
+
+def is_compressible(path):
+    mimetype = mimetypes.guess_type(path)[0] or ''
+    return mimetype.startswith(COMPRESSIBLE_TYPES)
+
+
+def build(static_folder, output='dist'):
+    """Fingerprint and precompress every file in ``static_folder``.
+
+    Returns the manifest, which maps original to hashed paths relative to
+    the static folder, using forward slashes.
+    """
+    output_folder = os.path.join(static_folder, output)
+    manifest = {}
+    for directory, subdirectories, filenames in os.walk(static_folder):
+        if os.path.abspath(directory) == os.path.abspath(output_folder):
+            subdirectories[:] = []
+            continue
+        for filename in sorted(filenames):
+            source = os.path.join(directory, filename)
+            path = os.path.relpath(source, static_folder).replace(os.sep, '/')
+            with open(source, 'rb') as source_file:
+                data = source_file.read()
+            hashed = posixpath.join(output, fingerprint(path, data))
+            target = os.path.join(static_folder, *hashed.split('/'))
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.copyfile(source, target)
+            if is_compressible(path):
+                _write_smaller(target + '.gz', gzip.compress(data, 9, mtime=0), data)
+                if brotli is not None:
+                    _write_smaller(target + '.br', brotli.compress(data), data)
+            manifest[path] = hashed
+
+    os.makedirs(output_folder, exist_ok=True)
+    manifest_path = os.path.join(output_folder, 'manifest.json')
+    with open(manifest_path + '.tmp', 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+    os.replace(manifest_path + '.tmp', manifest_path)
+    return manifest
+
+
+def _write_smaller(path, compressed, data):
+    # Tiny files can grow when compressed; those are only served as is.
+    if len(compressed) < len(data):
+        with open(path, 'wb') as compressed_file:
+            compressed_file.write(compressed)
+
+
+class Assets(object):
+    """Flask extension that serves the assets written by build().
+
+    Each app's manifest is kept in ``app.extensions['assets']``.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('ASSETS_OUTPUT', 'dist')
+        app.config.setdefault('ASSETS_MAX_AGE', 365 * 24 * 60 * 60)
+        state = app.extensions['assets'] = AssetsState(os.path.join(app.static_folder, app.config['ASSETS_OUTPUT']))
+        state.load_manifest()
+        app.url_defaults(self._hashed_url)
+        app.view_functions['static'] = self.send_static_file
+
+        command = AppGroup('assets', help='Build fingerprinted static assets.')
+
+        @command.command('build')
+        def build_command():
+            """Hash and precompress the static folder and write the manifest."""
+            manifest = build(app.static_folder, app.config['ASSETS_OUTPUT'])
+            state.load_manifest()
+            click.echo('Built %d assets into %s' % (len(manifest), app.config['ASSETS_OUTPUT']))
+
+        app.cli.add_command(command)
+
+    def _hashed_url(self, endpoint, values):
+        manifest = current_app.extensions['assets'].manifest
+        if endpoint == 'static' and values.get('filename') in manifest:
+            values['filename'] = manifest[values['filename']]
+
+    def send_static_file(self, filename):
+        app = current_app
+        if filename not in app.extensions['assets'].hashed:
+            return app.send_static_file(filename)
+
+        accepted = request.accept_encodings
+        for encoding, suffix in ENCODINGS:
+            if accepted[encoding] and os.path.exists(os.path.join(app.static_folder, filename + suffix)):
+                break
+        else:
+            encoding, suffix = None, ''
+        response = send_from_directory(app.static_folder, filename + suffix,
+                                       mimetype=mimetypes.guess_type(filename)[0],
+                                       download_name=posixpath.basename(filename),
+                                       max_age=app.config['ASSETS_MAX_AGE'])
+        if encoding:
+            response.content_encoding = encoding
+        response.vary.add('Accept-Encoding')
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response
+
+
+class AssetsState(object):
+    """One app's manifest, read from the build output ``folder``."""
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.manifest = {}
+        self.hashed = set()
+        self.build_id = None
+
+    def load_manifest(self):
+        try:
+            with open(os.path.join(self.folder, 'manifest.json')) as manifest_file:
+                self.manifest = json.load(manifest_file)
+        except FileNotFoundError:
+            self.manifest = {}
+        self.hashed = set(self.manifest.values())
+        # Identifies the deployed assets, for validators of pages that link them.
+        self.build_id = hashlib.sha256(json.dumps(self.manifest, sort_keys=True).encode()).hexdigest()[:12]
@@ -0,0 +1,46 @@
+"""Time for a new worker process to build the app.
+
+    python -m benchmarks.boot [--runs 9]
+
+Each run starts a new interpreter and times importing an entry point: wsgi,
+which production servers load, and main, the command-line entry point that
+also attaches Flask-Migrate. It also reports whether the PayPal SDK and
+Alembic were imported, which create_app() is meant to avoid.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+PROBE = '''
+import json, sys, time
+started = time.perf_counter()
+import %s
+print(json.dumps({'seconds': time.perf_counter() - started, 'modules': len(sys.modules),
+                  'paypalrestsdk': 'paypalrestsdk' in sys.modules, 'alembic': 'alembic' in sys.modules}))
+'''
+
+
+def measure(module, runs):
+    environment = dict(os.environ, DATABASE_URL='sqlite://')
+    results = [json.loads(subprocess.run([sys.executable, '-c', PROBE % module], env=environment, check=True,
+                                         capture_output=True, text=True).stdout.strip().splitlines()[-1])
+               for _ in range(runs)]
+    return dict(results[-1], seconds=statistics.median(result['seconds'] for result in results))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=9)
+    args = parser.parse_args()
+
+    for module in ('wsgi', 'main'):
+        result = measure(module, args.runs)
+        print('%-5s %7.1f ms   %4d modules   paypalrestsdk %-5s   alembic %s' % (
+            module, result['seconds'] * 1000, result['modules'], result['paypalrestsdk'], result['alembic']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""First-request latency of a new worker, with and without template warm-up.
+
+    python -m benchmarks.cold_start [--runs 5]
+
+Each run starts a new interpreter that imports wsgi and times its first and
+second GET of a few pages. The scenarios are:
+
+    lazy        no bytecode cache, templates compiled on first use
+    bytecode    templates loaded from a warm FileSystemBytecodeCache
+    precompile  bytecode cache plus JINJA_PRECOMPILE at import
+    forked      precompiled in a parent process, measured in a forked child,
+                as with a preloading server such as ``gunicorn --preload``
+
+Times are medians in milliseconds. "import" includes the warm-up.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+PATHS = ('/products', '/login', '/register')
+
+SCENARIOS = (
+    ('lazy', {'JINJA_BYTECODE_CACHE_DIR': '', 'JINJA_PRECOMPILE': '0'}, False),
+    ('bytecode', {'JINJA_PRECOMPILE': '0'}, False),
+    ('precompile', {'JINJA_PRECOMPILE': '1'}, False),
+    ('forked', {'JINJA_PRECOMPILE': '1'}, True),
+)
+
+
+def child(fork):
+    started = time.perf_counter()
+    from extensions import db
+    from models import Product
+    from wsgi import app
+    with app.app_context():
+        db.create_all()
+        db.session.add_all([Product(name='Product %d' % i, price=i) for i in range(20)])
+        db.session.commit()
+    imported = time.perf_counter() - started
+
+    if fork:
+        pid = os.fork()
+        if pid:
+            os.waitpid(pid, 0)
+            return
+    client = app.test_client()
+    timings = []
+    for _ in range(2):
+        started = time.perf_counter()
+        for path in PATHS:
+            client.get(path)
+        timings.append(time.perf_counter() - started)
+    print(json.dumps({'import': imported, 'first': timings[0], 'second': timings[1]}))
+    sys.stdout.flush()
+    if fork:
+        os._exit(0)
+
+
+def measure(environment, fork, runs):
+    results = []
+    for _ in range(runs):
+        command = [sys.executable, '-m', 'benchmarks.cold_start', '--child']
+        if fork:
+            command.append('--fork')
+        output = subprocess.run(command, env=environment, check=True, capture_output=True, text=True).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    return {key: statistics.median(result[key] for result in results) * 1000 for key in results[0]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--fork', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args.fork)
+        return
+
+    cache_dir = tempfile.mkdtemp()
+    base = dict(os.environ, DATABASE_URL='sqlite://', JINJA_BYTECODE_CACHE_DIR=cache_dir)
+    # Fill the bytecode cache, as the previous deploy's workers would have.
+    measure(dict(base, JINJA_PRECOMPILE='1'), False, 1)
+    print('%-11s %9s %13s %14s' % ('', 'import', 'first request', 'second request'))
+    for label, overrides, fork in SCENARIOS:
+        timings = measure(dict(base, **overrides), fork, args.runs)
+        print('%-11s %7.1f ms %10.1f ms %11.1f ms' % (label, timings['import'], timings['first'], timings['second']))
+
+
+if __name__ == '__main__':
+    main()
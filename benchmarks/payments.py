@@ -0,0 +1,84 @@
+"""Load-test checkout against a local fake PayPal.
+
+    python -m benchmarks.payments [--requests 200] [--clients 16] [--latency 0.25]
+
+Every gateway call sleeps for --latency seconds. The report compares the
+checkout request latency, which should stay far below the gateway latency,
+with the rate at which the payment queue turns intents into PayPal payments.
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import threading
+import time
+
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db'))
+
+from extensions import db, payments
+from models import Cart, PaymentIntent, Product, User
+from payments import FakePayPalServer, PayPalGateway
+from wsgi import app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--latency', type=float, default=0.25)
+    args = parser.parse_args()
+
+    server = FakePayPalServer(latency=args.latency).start()
+    payments.gateway = PayPalGateway('sandbox', 'id', 'secret', endpoint=server.url)
+    app.config['WTF_CSRF_ENABLED'] = False
+
+    with app.app_context():
+        db.create_all()
+        user = User(username='bench', email='bench@example.com', password='unused')
+        product = Product(name='Bench product', price=9.99)
+        db.session.add_all([user, product])
+        db.session.flush()
+        db.session.add(Cart(user_id=user.id, product_id=product.id, quantity=2))
+        db.session.commit()
+        user_id = user.id
+
+    latencies = []
+    lock = threading.Lock()
+    per_client = args.requests // args.clients
+
+    def client():
+        test_client = app.test_client()
+        with test_client.session_transaction() as session:
+            session['_user_id'] = str(user_id)
+        for _ in range(per_client):
+            started = time.perf_counter()
+            response = test_client.post('/checkout')
+            elapsed = time.perf_counter() - started
+            assert response.status_code in (202, 503), response.status_code
+            with lock:
+                latencies.append(elapsed)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(args.clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    accepted = time.perf_counter() - started
+    payments.queue.join()
+    finished = time.perf_counter() - started
+    server.stop()
+
+    with app.app_context():
+        created = PaymentIntent.query.filter_by(status='created').count()
+    latencies.sort()
+    print('checkout requests: %d from %d clients, gateway latency %.0f ms'
+          % (len(latencies), args.clients, args.latency * 1000))
+    print('checkout latency: p50 %.1f ms, p99 %.1f ms'
+          % (statistics.median(latencies) * 1000, latencies[int(len(latencies) * 0.99) - 1] * 1000))
+    print('all checkouts accepted in %.2f s; %d payments created in %.2f s (%.1f/s)'
+          % (accepted, created, finished, created / finished))
+
+
+if __name__ == '__main__':
+    main()
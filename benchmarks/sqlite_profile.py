@@ -0,0 +1,107 @@
+"""Concurrent read/write throughput of SQLite with and without the profile.
+
+    python -m benchmarks.sqlite_profile [--readers 8] [--writers 4] [--seconds 5]
+
+Readers fetch catalog pages and writers upsert cart lines, each in its own
+transaction, against two fresh database files: one with SQLAlchemy defaults
+(rollback journal) and one with SQLITE_PRAGMAS and the tuned pool from
+config.py. Failed operations are mostly "database is locked" errors.
+"""
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.exc import OperationalError
+
+from extensions import apply_sqlite_pragmas, db
+from models import Product
+from wsgi import app
+
+PRODUCTS = 5000
+USERS = 200
+
+READ = text('SELECT id, name, price FROM product WHERE id > :after ORDER BY id LIMIT 20')
+WRITE = text(
+    'INSERT INTO cart (user_id, product_id, quantity, updated_at) VALUES (:user_id, :product_id, 1, :now) '
+    'ON CONFLICT (user_id, product_id) DO UPDATE SET quantity = quantity + 1, updated_at = excluded.updated_at'
+)
+
+
+def build(path, profiled):
+    options = {}
+    if profiled:
+        options = dict(pool_size=app.config['SQLITE_POOL_SIZE'],
+                       max_overflow=app.config['SQLITE_MAX_OVERFLOW'],
+                       pool_timeout=app.config['SQLITE_POOL_TIMEOUT'])
+    engine = create_engine('sqlite:///' + path, **options)
+    if profiled:
+        event.listen(engine, 'connect',
+                     lambda dbapi_connection, record: apply_sqlite_pragmas(dbapi_connection, app.config['SQLITE_PRAGMAS']))
+    db.metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(text('INSERT INTO user (id, username, email, password) VALUES (:id, :name, :email, :pw)'),
+                           [{'id': i, 'name': 'u%d' % i, 'email': 'u%d@example.com' % i, 'pw': 'x'}
+                            for i in range(1, USERS + 1)])
+        connection.execute(Product.__table__.insert(),
+                           [{'id': i, 'name': 'p%d' % i, 'price': i % 100} for i in range(1, PRODUCTS + 1)])
+    return engine
+
+
+def run(engine, readers, writers, seconds):
+    counts = {'reads': 0, 'writes': 0, 'errors': 0}
+    lock = threading.Lock()
+    deadline = time.monotonic() + seconds
+
+    def worker(kind):
+        done = errors = 0
+        while time.monotonic() < deadline:
+            try:
+                if kind == 'reads':
+                    with engine.connect() as connection:
+                        connection.execute(READ, {'after': random.randrange(PRODUCTS)}).fetchall()
+                else:
+                    with engine.begin() as connection:
+                        connection.execute(WRITE, {'user_id': random.randint(1, USERS),
+                                                   'product_id': random.randint(1, PRODUCTS),
+                                                   'now': datetime.utcnow()})
+                done += 1
+            except OperationalError:
+                errors += 1
+        with lock:
+            counts[kind] += done
+            counts['errors'] += errors
+
+    threads = [threading.Thread(target=worker, args=('reads',)) for _ in range(readers)]
+    threads += [threading.Thread(target=worker, args=('writes',)) for _ in range(writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=5)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    for label, profiled in (('default', False), ('profile', True)):
+        engine = build(os.path.join(directory, label + '.db'), profiled)
+        counts = run(engine, args.readers, args.writers, args.seconds)
+        engine.dispose()
+        print('%-8s reads/s %8.0f   writes/s %7.0f   failed ops %d' % (
+            label, counts['reads'] / args.seconds, counts['writes'] / args.seconds, counts['errors']))
+
+
+if __name__ == '__main__':
+    main()
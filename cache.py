@@ -0,0 +1,158 @@
+"""Caches shared by the request handlers.
+
+TTLCache lives in one process. SQLiteCache keeps entries in a SQLite file,
+so every worker on a host shares them. Both offer the same get/set/pop/clear
+and get_many/set_many interface, and both evict the oldest entries once they
+hold ``maxsize`` of them. make_cache() builds whichever one the config names.
+"""
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache(object):
+    """A thread-safe LRU mapping whose entries also expire after ``ttl`` seconds.
+
+    Once ``maxsize`` entries are stored, setting a new key evicts the least
+    recently used one. ``hits`` and ``misses`` count lookups.
+    """
+
+    def __init__(self, maxsize=1024, ttl=60, timer=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timer = timer
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > self.timer():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (self.timer() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def get_many(self, keys):
+        """Return a dict of the keys that are present."""
+        found = {}
+        for key in keys:
+            value = self.get(key)
+            if value is not None:
+                found[key] = value
+        return found
+
+    def set_many(self, mapping):
+        for key, value in mapping.items():
+            self.set(key, value)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            return default if entry is None else entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteCache(object):
+    """A string cache stored in a SQLite file that several processes can share.
+
+    Each thread gets its own connection in WAL mode, and a forked worker
+    opens new ones instead of sharing its parent's. Entries expire after
+    ``ttl`` seconds. Every write trims the table back to the ``maxsize`` most
+    recently written entries. Only ``hits`` and ``misses`` are counted per
+    process.
+    """
+
+    def __init__(self, path, maxsize=1024, ttl=300, timer=time.time):
+        self.path = path
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timer = timer
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+        with self._connection() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS cache ('
+                               'key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL)')
+            connection.execute('CREATE INDEX IF NOT EXISTS ix_cache_expires ON cache (expires)')
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=5)
+            connection.execute('PRAGMA journal_mode = WAL')
+            connection.execute('PRAGMA synchronous = NORMAL')
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def get(self, key, default=None):
+        return self.get_many([key]).get(key, default)
+
+    def get_many(self, keys):
+        keys = list(keys)
+        if not keys:
+            return {}
+        rows = self._connection().execute(
+            'SELECT key, value FROM cache WHERE expires > ? AND key IN (%s)' % ', '.join('?' * len(keys)),
+            [self.timer()] + keys).fetchall()
+        found = dict(rows)
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def set(self, key, value):
+        self.set_many({key: value})
+
+    def set_many(self, mapping):
+        expires = self.timer() + self.ttl
+        with self._connection() as connection:
+            connection.executemany('INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)',
+                                   [(key, value, expires) for key, value in mapping.items()])
+            connection.execute('DELETE FROM cache WHERE key IN ('
+                               'SELECT key FROM cache ORDER BY expires DESC LIMIT -1 OFFSET ?)', (self.maxsize,))
+
+    def pop(self, key, default=None):
+        value = self.get(key, default)
+        with self._connection() as connection:
+            connection.execute('DELETE FROM cache WHERE key = ?', (key,))
+        return value
+
+    def clear(self):
+        with self._connection() as connection:
+            connection.execute('DELETE FROM cache')
+
+    def __len__(self):
+        return self._connection().execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+
+
+def make_cache(backend, maxsize, ttl, path=None):
+    """Build a 'memory' (TTLCache) or 'sqlite' (SQLiteCache at ``path``) cache."""
+    if backend == 'sqlite':
+        return SQLiteCache(path, maxsize=maxsize, ttl=ttl)
+    if backend == 'memory':
+        return TTLCache(maxsize=maxsize, ttl=ttl)
+    raise ValueError('Unknown cache backend %r' % backend)
@@ -0,0 +1,92 @@
+"""Extension instances shared by the models and blueprints.
+
+They are created unbound here and attached to an application by
+application.create_app(), so importing a model or a view never builds an app.
+"""
+import sqlite3
+from functools import wraps
+
+from flask import g, has_request_context, request
+from flask_login import LoginManager
+from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
+from sqlalchemy.engine import make_url
+from sqlalchemy.sql.dml import UpdateBase
+
+from assets import Assets
+from hashing import PasswordHasher
+from instrumentation import QueryStats
+from mail import Mailer
+from metrics import Metrics
+from payments import Payments
+
+
+class RoutingSession(Session):
+    """Session that reads from the replica during read-only requests.
+
+    A view decorated with read_only sets ``g.use_replica`` for GET and HEAD
+    requests. Queries then go to the 'replica' bind, when one is configured.
+    Flushes and INSERT/UPDATE/DELETE statements always go to the primary.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and not self._flushing and not isinstance(clause, UpdateBase)
+                and has_request_context() and g.get('use_replica')):
+            replica = self._db.engines.get('replica')
+            if replica is not None:
+                return replica
+        return super(RoutingSession, self).get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+def read_only(view):
+    """Let the view's GET and HEAD requests read from the replica."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        g.use_replica = request.method in ('GET', 'HEAD')
+        return view(*args, **kwargs)
+    return wrapper
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+login_manager = LoginManager()
+login_manager.login_view = 'auth.login'
+password_hasher = PasswordHasher()
+payments = Payments()
+mailer = Mailer()
+query_stats = QueryStats()
+metrics = Metrics()
+assets = Assets()
+
+def apply_sqlite_pragmas(dbapi_connection, pragmas):
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in pragmas.items():
+            cursor.execute('PRAGMA %s = %s' % (name, value))
+    finally:
+        cursor.close()
+
+def sqlite_connection_configurer(pragmas):
+    """Return a 'connect' listener that applies ``pragmas`` to SQLite connections."""
+    def configure_sqlite_connection(dbapi_connection, connection_record):
+        if isinstance(dbapi_connection, sqlite3.Connection):
+            apply_sqlite_pragmas(dbapi_connection, pragmas)
+    return configure_sqlite_connection
+
+def engine_options(url, config):
+    """Return SQLAlchemy engine options for ``url`` from the pool settings in ``config``."""
+    url = make_url(url)
+    if url.get_backend_name() == 'postgresql':
+        return {
+            'pool_size': config['DB_POOL_SIZE'],
+            'max_overflow': config['DB_MAX_OVERFLOW'],
+            'pool_timeout': config['DB_POOL_TIMEOUT'],
+            'pool_recycle': config['DB_POOL_RECYCLE'],
+            'pool_pre_ping': True,
+        }
+    if url.get_backend_name() == 'sqlite' and url.database not in (None, '', ':memory:'):
+        # Every pooled connection is a reader under WAL. In-memory databases
+        # get Flask-SQLAlchemy's StaticPool instead.
+        return {
+            'pool_size': config['SQLITE_POOL_SIZE'],
+            'max_overflow': config['SQLITE_MAX_OVERFLOW'],
+            'pool_timeout': config['SQLITE_POOL_TIMEOUT'],
+        }
+    return {}
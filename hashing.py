@@ -0,0 +1,83 @@
+"""Password hashing on a bounded worker pool.
+
+pbkdf2 deliberately burns hundreds of milliseconds of CPU per call. Running
+it on the request thread lets a burst of logins occupy every worker, so the
+hashing is handed to a small pool instead. hashlib releases the GIL while it
+iterates, so pool threads hash in parallel with request threads serving other
+pages. At most ``workers + queue_size`` hashes are running or waiting at any
+time. Beyond that, callers wait up to ``wait`` seconds for a slot and then
+get HashingBusy, which keeps a credential-stuffing burst from building an
+unbounded backlog.
+"""
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+class HashingBusy(Exception):
+    """Raised when the hashing pool and its queue are full."""
+
+
+class PasswordHasher(object):
+
+    def __init__(self, app=None):
+        self._executor = None
+        self._slots = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('PASSWORD_HASH_METHOD', 'pbkdf2:sha256')
+        app.config.setdefault('PASSWORD_HASH_WORKERS', 2)
+        app.config.setdefault('PASSWORD_HASH_QUEUE_SIZE', 8)
+        app.config.setdefault('PASSWORD_HASH_WAIT', 1.0)
+        self.configure(method=app.config['PASSWORD_HASH_METHOD'],
+                       workers=app.config['PASSWORD_HASH_WORKERS'],
+                       queue_size=app.config['PASSWORD_HASH_QUEUE_SIZE'],
+                       wait=app.config['PASSWORD_HASH_WAIT'])
+        app.extensions['password_hasher'] = self
+
+    def configure(self, method='pbkdf2:sha256', workers=2, queue_size=8, wait=1.0):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+        self.method = method
+        self.wait = wait
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+
+    def submit(self, fn, *args):
+        """Run ``fn(*args)`` on the pool and return its Future.
+
+        Raises HashingBusy if no slot frees up within ``wait`` seconds.
+        """
+        if not self._slots.acquire(timeout=self.wait):
+            raise HashingBusy()
+        try:
+            future = self._executor.submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def hash_future(self, password):
+        return self.submit(generate_password_hash, password, self.method)
+
+    def check_future(self, pwhash, password):
+        return self.submit(check_password_hash, pwhash, password)
+
+    def hash(self, password):
+        """Hash ``password`` on the pool, blocking until it is done."""
+        return self.hash_future(password).result()
+
+    def check(self, pwhash, password):
+        """Check ``password`` against ``pwhash`` on the pool, blocking until done."""
+        return self.check_future(pwhash, password).result()
+
+    async def hash_async(self, password):
+        return await asyncio.wrap_future(self.hash_future(password))
+
+    async def check_async(self, pwhash, password):
+        return await asyncio.wrap_future(self.check_future(pwhash, password))
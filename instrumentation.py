@@ -0,0 +1,117 @@
+"""Per-request SQL statistics.
+
+SQLAlchemy cursor events time every statement. While a request is active,
+QueryStats adds each timing to that request's totals. The response reports
+them in a ``Server-Timing`` header, which browser dev tools show next to the
+request. Statements slower than SQL_SLOW_QUERY_THRESHOLD seconds are logged
+to the ``sql.slow`` logger whether or not a request is active. Statement
+text only goes to the log, never into the response headers. If
+SQL_QUERY_BUDGET is set, a request that issues more statements raises
+QueryBudgetExceeded, which is meant for tests and development.
+"""
+import logging
+import time
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+
+slow_query_log = logging.getLogger('sql.slow')
+
+
+class QueryBudgetExceeded(Exception):
+    """Raised when a request issues more statements than SQL_QUERY_BUDGET."""
+
+
+class RequestQueryStats(object):
+
+    def __init__(self, keep_slowest):
+        self.count = 0
+        self.duration = 0.0
+        self.slowest = []
+        self.keep_slowest = keep_slowest
+
+    def record(self, statement, duration):
+        self.count += 1
+        self.duration += duration
+        if self.keep_slowest:
+            self.slowest.append((duration, statement))
+            self.slowest.sort(key=lambda entry: entry[0], reverse=True)
+            del self.slowest[self.keep_slowest:]
+
+
+class QueryStats(object):
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('SQL_SLOW_QUERY_THRESHOLD', 0.1)
+        app.config.setdefault('SQL_QUERY_BUDGET', None)
+        app.config.setdefault('SQL_SERVER_TIMING', True)
+        app.config.setdefault('SQL_SERVER_TIMING_SLOWEST', 3)
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+        app.extensions['query_stats'] = self
+
+    def instrument_engine(self, engine, config):
+        """Time the statements run on ``engine``, an engine of the app ``config`` belongs to.
+
+        Listeners are attached to each engine rather than to the Engine
+        class, so building a second app does not count statements twice.
+        """
+        def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            self._after_cursor_execute(config, statement, time.perf_counter() - conn.info['query_started'].pop())
+
+        if not event.contains(engine, 'before_cursor_execute', self._before_cursor_execute):
+            event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+            event.listen(engine, 'after_cursor_execute', after_cursor_execute)
+            event.listen(engine, 'handle_error', self._handle_error)
+
+    @staticmethod
+    def current():
+        """Return the active request's RequestQueryStats, or None outside a request."""
+        if has_request_context():
+            return g.get('query_stats')
+        return None
+
+    def _start_request(self):
+        g.query_stats = RequestQueryStats(current_app.config['SQL_SERVER_TIMING_SLOWEST'])
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    @staticmethod
+    def _handle_error(context):
+        # after_cursor_execute does not run for a statement that raised, so
+        # its start time would stay on the pooled connection for good.
+        started = context.connection.info.get('query_started') if context.connection is not None else None
+        if started:
+            started.pop()
+
+    def _after_cursor_execute(self, config, statement, duration):
+        stats = self.current()
+        if stats is not None:
+            stats.record(statement, duration)
+        if duration >= config['SQL_SLOW_QUERY_THRESHOLD']:
+            slow_query_log.warning('%.1f ms%s: %s', duration * 1000,
+                                   ' in %s' % request.endpoint if has_request_context() else '',
+                                   ' '.join(statement.split()))
+
+    def _finish_request(self, response):
+        stats = self.current()
+        if stats is None:
+            return response
+
+        config = current_app.config
+        budget = config['SQL_QUERY_BUDGET']
+        if budget is not None and stats.count > budget:
+            raise QueryBudgetExceeded('%s issued %d SQL statements, over the budget of %d'
+                                      % (request.endpoint, stats.count, budget))
+
+        if config['SQL_SERVER_TIMING']:
+            timings = ['db;desc="queries: %d";dur=%.1f' % (stats.count, stats.duration * 1000)]
+            timings.extend('db-slow-%d;dur=%.1f' % (rank, duration * 1000)
+                           for rank, (duration, statement) in enumerate(stats.slowest, 1))
+            response.headers.add('Server-Timing', ', '.join(timings))
+        return response
@@ -0,0 +1,245 @@
+"""Outgoing mail: a pooled SMTP client and the worker that sends from the outbox.
+
+Checkout never talks to an SMTP server. It writes an outbox row in the same
+transaction as the order, and a background worker sends outbox messages in
+batches over connections kept open in an SMTPPool. DebuggingSMTPServer is a
+local stand-in that accepts mail and keeps it for inspection, so the whole
+path runs offline.
+"""
+import email
+import email.policy
+import logging
+import queue
+import smtplib
+import socketserver
+import threading
+from contextlib import contextmanager
+
+from flask import current_app
+
+logger = logging.getLogger(__name__)
+
+
+class SMTPPool(object):
+    """Keeps up to ``size`` logged-in SMTP connections open for reuse.
+
+    A connection that raised is closed rather than returned, and an idle one
+    is checked with NOOP before it is handed out again, so a connection the
+    server timed out is replaced transparently.
+    """
+
+    def __init__(self, host, port, size=2, username=None, password=None, use_tls=False, timeout=10):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self.timeout = timeout
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    def _connect(self):
+        smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            if self.use_tls:
+                smtp.starttls()
+            if self.username:
+                smtp.login(self.username, self.password)
+        except BaseException:
+            smtp.close()
+            raise
+        return smtp
+
+    def _checkout(self):
+        while True:
+            try:
+                smtp = self._idle.get_nowait()
+            except queue.Empty:
+                return self._connect()
+            try:
+                if smtp.noop()[0] == 250:
+                    return smtp
+            except (smtplib.SMTPException, OSError):
+                pass
+            smtp.close()
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection for the duration of the ``with`` block."""
+        smtp = self._checkout()
+        try:
+            yield smtp
+        except BaseException:
+            smtp.close()
+            raise
+        try:
+            self._idle.put_nowait(smtp)
+        except queue.Full:
+            smtp.quit()
+
+    def close(self):
+        while True:
+            try:
+                smtp = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                smtp.close()
+
+
+class Mailer(object):
+    """Flask extension giving each app its own SMTP pool and background sender.
+
+    The state lives in ``app.extensions['mailer']``, so apps built with
+    different configs never share a pool. Like the payment gateway, the pool
+    is created on first use, and so is the sender thread, so create_app()
+    starts no threads and opens no sockets.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('MAIL_BACKEND', 'smtp')
+        app.config.setdefault('MAIL_SERVER', 'localhost')
+        app.config.setdefault('MAIL_PORT', 25)
+        app.config.setdefault('MAIL_USERNAME', None)
+        app.config.setdefault('MAIL_PASSWORD', None)
+        app.config.setdefault('MAIL_USE_TLS', False)
+        app.config.setdefault('MAIL_TIMEOUT', 10)
+        app.config.setdefault('MAIL_SENDER', 'orders@localhost')
+        app.config.setdefault('MAIL_POOL_SIZE', 2)
+        app.config.setdefault('MAIL_BATCH_SIZE', 50)
+        app.config.setdefault('MAIL_MAX_ATTEMPTS', 8)
+        app.config.setdefault('MAIL_RETRY_BACKOFF', 30)
+        app.config.setdefault('MAIL_RETRY_MAX_BACKOFF', 3600)
+        app.config.setdefault('MAIL_CLAIM_TIMEOUT', 300)
+        app.config.setdefault('MAIL_POLL_INTERVAL', 10.0)
+        app.config.setdefault('MAIL_SEND_IN_BACKGROUND', True)
+        app.extensions['mailer'] = MailerState(app.config)
+
+    def get_pool(self):
+        """Return the current app's SMTP pool, creating it on first use."""
+        return current_app.extensions['mailer'].get_pool()
+
+    def start_worker(self, drain):
+        """Run ``drain`` on the current app's sender thread; see MailerState.start_worker()."""
+        current_app.extensions['mailer'].start_worker(drain)
+
+
+class MailerState(object):
+    """One app's SMTP pool and sender thread."""
+
+    def __init__(self, config):
+        self.config = config
+        self.pool = None
+        self.debug_server = None
+        self._worker = None
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+
+    def get_pool(self):
+        with self._lock:
+            if self.pool is None:
+                host, port = self.config['MAIL_SERVER'], self.config['MAIL_PORT']
+                if self.config['MAIL_BACKEND'] == 'debug':
+                    self.debug_server = DebuggingSMTPServer().start()
+                    host, port = self.debug_server.address
+                self.pool = SMTPPool(host, port, size=self.config['MAIL_POOL_SIZE'],
+                                     username=self.config['MAIL_USERNAME'], password=self.config['MAIL_PASSWORD'],
+                                     use_tls=self.config['MAIL_USE_TLS'], timeout=self.config['MAIL_TIMEOUT'])
+            return self.pool
+
+    def start_worker(self, drain):
+        """Run ``drain`` on a daemon thread now, and again every MAIL_POLL_INTERVAL.
+
+        The thread is started by the first call. Later calls only wake it up,
+        so a freshly written message is sent without waiting for the poll.
+        """
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, args=(drain,), name='mailer', daemon=True)
+                self._worker.start()
+        self._wakeup.set()
+
+    def _run(self, drain):
+        while True:
+            self._wakeup.wait(self.config['MAIL_POLL_INTERVAL'])
+            self._wakeup.clear()
+            try:
+                drain()
+            except Exception:
+                logger.exception('Sending mail from the outbox failed')
+
+
+class DebuggingSMTPServer(object):
+    """A local SMTP server that accepts every message and keeps it.
+
+    Received messages are parsed into ``messages``. Setting ``fail_next`` to
+    n answers the next n messages with a temporary 451 error, for exercising
+    retries.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self.messages = []
+        self.connections = 0
+        self.fail_next = 0
+        self._server = socketserver.ThreadingTCPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def address(self):
+        return self._server.server_address[:2]
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='debug-smtp', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _handler(self):
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                server.connections += 1
+                self._reply('220 debugging SMTP server ready')
+                while True:
+                    line = self.rfile.readline()
+                    if not line:
+                        return
+                    verb = line.split(b' ', 1)[0].strip().upper()
+                    if verb in (b'EHLO', b'HELO', b'MAIL', b'RCPT', b'RSET', b'NOOP'):
+                        self._reply('250 OK')
+                    elif verb == b'DATA':
+                        self._reply('354 End data with <CR><LF>.<CR><LF>')
+                        self._receive()
+                    elif verb == b'QUIT':
+                        self._reply('221 Bye')
+                        return
+                    else:
+                        self._reply('502 Command not implemented')
+
+            def _receive(self):
+                lines = []
+                for line in self.rfile:
+                    if line in (b'.\r\n', b'.\n'):
+                        break
+                    lines.append(line[1:] if line.startswith(b'..') else line)
+                if server.fail_next:
+                    server.fail_next -= 1
+                    self._reply('451 Try again later')
+                    return
+                server.messages.append(email.message_from_bytes(b''.join(lines), policy=email.policy.default))
+                self._reply('250 Queued')
+
+            def _reply(self, line):
+                self.wfile.write(line.encode('ascii') + b'\r\n')
+
+        return Handler
@@ -0,0 +1,398 @@
+"""In-process metrics exposed in the Prometheus text format.
+
+Counters, gauges and histograms are plain dicts guarded by a lock per metric,
+so updating one costs a dict lookup and an addition. Callback metrics are
+read only when the metrics are collected, which suits values that are already
+tracked elsewhere, such as pool overflow or cache hit counts.
+
+With several worker processes, set METRICS_MULTIPROC_DIR to a directory
+shared by the workers. Each process then writes its samples there at most
+every METRICS_FLUSH_INTERVAL seconds, and /metrics adds up the files from all
+processes. Counters and histograms of processes that have exited are folded
+into one file and kept, so they never go backwards. Their gauges describe
+state that ended with the process and are dropped.
+"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from flask import Response, current_app, g, has_app_context, request
+from sqlalchemy import event
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Counters and histograms of exited workers, under METRICS_MULTIPROC_DIR.
+EXITED_SNAPSHOT = 'exited.json'
+
+
+class Metric(object):
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError('%s expects labels %r, got %r' % (self.name, self.labelnames, sorted(labels)))
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key):
+        return list(zip(self.labelnames, key))
+
+    def samples(self):
+        """Yield (sample name, [(label, value), ...], value) triples."""
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield self.name, self._labels(key), value
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][index] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def samples(self):
+        with self._lock:
+            items = [(key, (list(state[0]), state[1], state[2])) for key, state in self._values.items()]
+        for key, (counts, total, count) in items:
+            labels = self._labels(key)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield self.name + '_bucket', labels + [('le', repr(float(bound)))], cumulative
+            yield self.name + '_bucket', labels + [('le', '+Inf')], count
+            yield self.name + '_sum', labels, total
+            yield self.name + '_count', labels, count
+
+
+class CallbackMetric(Metric):
+    """A metric whose values come from ``callback()`` at collection time.
+
+    The callback returns a mapping of label-value tuples to numbers.
+    """
+
+    def __init__(self, name, documentation, type, callback, labelnames=()):
+        super(CallbackMetric, self).__init__(name, documentation, labelnames)
+        self.type = type
+        self.callback = callback
+
+    def samples(self):
+        for key, value in self.callback().items():
+            yield self.name, self._labels(key), value
+
+
+class Registry(object):
+
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def callback(self, name, documentation, type, callback, labelnames=()):
+        return self.register(CallbackMetric(name, documentation, type, callback, labelnames))
+
+    def snapshot(self):
+        """Return every metric as a JSON-friendly dict keyed by metric name."""
+        with self._lock:
+            metrics = list(self._metrics)
+        return {metric.name: {
+            'type': metric.type,
+            'help': metric.documentation,
+            'samples': [[name, labels, value] for name, labels, value in metric.samples()],
+        } for metric in metrics}
+
+
+def merge_snapshots(snapshots):
+    """Add up samples with the same name and labels across snapshots."""
+    merged = {}
+    for snapshot in snapshots:
+        for name, metric in snapshot.items():
+            target = merged.setdefault(name, {'type': metric['type'], 'help': metric['help'], 'samples': {}})
+            for sample_name, labels, value in metric['samples']:
+                key = (sample_name, tuple(tuple(pair) for pair in labels))
+                target['samples'][key] = target['samples'].get(key, 0) + value
+    return {name: {'type': metric['type'], 'help': metric['help'],
+                   'samples': [[sample_name, list(labels), value]
+                               for (sample_name, labels), value in metric['samples'].items()]}
+            for name, metric in merged.items()}
+
+
+def without_gauges(snapshot):
+    """Return ``snapshot`` with its gauges left out."""
+    return {name: metric for name, metric in snapshot.items() if metric['type'] != 'gauge'}
+
+
+def _written_by_exited_worker(path):
+    """Return whether ``path`` is the snapshot of a worker that has exited."""
+    name = os.path.basename(path)[:-len('.json')]
+    if not name.isdigit():
+        return False
+    try:
+        os.kill(int(name), 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        pass
+    return False
+
+
+def render(snapshot):
+    """Format a snapshot in the Prometheus text exposition format."""
+    lines = []
+    for name in sorted(snapshot):
+        metric = snapshot[name]
+        lines.append('# HELP %s %s' % (name, metric['help']))
+        lines.append('# TYPE %s %s' % (name, metric['type']))
+        for sample_name, labels, value in metric['samples']:
+            if labels:
+                label_text = ','.join('%s="%s"' % (label, str(label_value).replace('\\', '\\\\').replace('"', '\\"'))
+                                      for label, label_value in labels)
+                lines.append('%s{%s} %s' % (sample_name, label_text, _format_value(value)))
+            else:
+                lines.append('%s %s' % (sample_name, _format_value(value)))
+    return '\n'.join(lines) + '\n'
+
+
+def _format_value(value):
+    if isinstance(value, float) and not value.is_integer():
+        return repr(value)
+    return str(int(value))
+
+
+class Metrics(object):
+    """Flask extension that records request metrics and serves /metrics.
+
+    The registry is shared by the process. What belongs to one app, its
+    engines, caches and flush schedule, lives in ``app.extensions['metrics']``.
+    """
+
+    def __init__(self, app=None):
+        self.registry = Registry()
+        self.requests = self.registry.counter(
+            'http_requests_total', 'HTTP requests handled.', ['endpoint', 'method', 'status'])
+        self.latency = self.registry.histogram(
+            'http_request_duration_seconds', 'Time spent handling HTTP requests.', ['endpoint'])
+        self.in_flight = self.registry.gauge(
+            'http_requests_in_flight', 'HTTP requests currently being handled.')
+        self.pool_checkouts = self.registry.counter(
+            'db_pool_checkouts_total', 'Connections checked out of the pool.', ['engine'])
+        self.pool_checked_out = self.registry.gauge(
+            'db_pool_checked_out', 'Connections currently checked out of the pool.', ['engine'])
+        self.registry.callback('db_pool_overflow', 'Connections open beyond the pool size.', 'gauge',
+                               self._pool_overflow, ['engine'])
+        self.registry.callback('cache_hits_total', 'Cache lookups that found a value.', 'counter',
+                               lambda: self._cache_stat('hits'), ['cache'])
+        self.registry.callback('cache_misses_total', 'Cache lookups that found nothing.', 'counter',
+                               lambda: self._cache_stat('misses'), ['cache'])
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('METRICS_MULTIPROC_DIR', None)
+        app.config.setdefault('METRICS_FLUSH_INTERVAL', 5.0)
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+        app.teardown_request(self._teardown_request)
+        app.add_url_rule('/metrics', 'metrics', self.view)
+        app.extensions['metrics'] = MetricsState()
+
+    def instrument_engine(self, name, engine):
+        """Count pool checkouts for ``engine`` and report its overflow in the current app."""
+        current_app.extensions['metrics'].engines[name] = engine
+        event.listen(engine, 'checkout', lambda *args: self._on_checkout(name))
+        event.listen(engine, 'checkin', lambda *args: self.pool_checked_out.dec(engine=name))
+
+    def track_cache(self, name, cache):
+        """Report ``cache.hits`` and ``cache.misses`` under ``name`` in the current app."""
+        current_app.extensions['metrics'].caches[name] = cache
+
+    def _on_checkout(self, name):
+        self.pool_checkouts.inc(engine=name)
+        self.pool_checked_out.inc(engine=name)
+
+    def _pool_overflow(self):
+        if not has_app_context():
+            return {}
+        return {(name,): engine.pool.overflow() for name, engine in current_app.extensions['metrics'].engines.items()
+                if hasattr(engine.pool, 'overflow')}
+
+    def _cache_stat(self, attribute):
+        if not has_app_context():
+            return {}
+        return {(name,): getattr(cache, attribute)
+                for name, cache in current_app.extensions['metrics'].caches.items()}
+
+    def _start_request(self):
+        g.metrics_started = time.perf_counter()
+        self.in_flight.inc()
+
+    def _finish_request(self, response):
+        started = g.get('metrics_started')
+        if started is not None:
+            endpoint = request.endpoint or 'unmatched'
+            self.latency.observe(time.perf_counter() - started, endpoint=endpoint)
+            self.requests.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+        return response
+
+    def _teardown_request(self, exc):
+        # Contexts pushed without dispatching a request (test clients'
+        # session_transaction, for one) tear down without having started.
+        if g.pop('metrics_started', None) is not None:
+            self.in_flight.dec()
+            self._maybe_flush()
+
+    def _snapshot_path(self, name=None):
+        return os.path.join(current_app.config['METRICS_MULTIPROC_DIR'], '%s.json' % (name or os.getpid()))
+
+    def _maybe_flush(self, force=False):
+        config, state = current_app.config, current_app.extensions['metrics']
+        if not config['METRICS_MULTIPROC_DIR']:
+            return
+        now = time.monotonic()
+        if not force and now - state.last_flush < config['METRICS_FLUSH_INTERVAL']:
+            return
+        with state.flush_lock:
+            state.last_flush = now
+            self._write_snapshot(self._snapshot_path())
+
+    def _write_snapshot(self, path):
+        with open(path + '.tmp', 'w') as snapshot_file:
+            json.dump(self.registry.snapshot(), snapshot_file)
+        os.replace(path + '.tmp', path)
+
+    def flush(self, name):
+        """Write this process's metrics for /metrics to report, under ``name``.
+
+        Command-line jobs serve no requests, so nothing else would write
+        their metrics. Each run replaces the previous run's snapshot of the
+        same name instead of leaving one behind per process id.
+        """
+        if current_app.config['METRICS_MULTIPROC_DIR']:
+            with current_app.extensions['metrics'].flush_lock:
+                self._write_snapshot(self._snapshot_path(name))
+
+    @contextmanager
+    def _locked(self, directory):
+        with open(os.path.join(directory, '.lock'), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+    def collect(self):
+        """Return the merged snapshot for this process, or for all processes.
+
+        The snapshots of worker processes that have exited are folded into
+        EXITED_SNAPSHOT, without their gauges, and removed. Named snapshots
+        written by flush() are kept as they are. Folding needs fcntl to stop
+        two workers from folding the same snapshot; without it every
+        snapshot is reported as if its process were running.
+        """
+        directory = current_app.config['METRICS_MULTIPROC_DIR']
+        if not directory:
+            return self.registry.snapshot()
+        self._maybe_flush(force=True)
+        if fcntl is None:
+            return merge_snapshots(self._read_snapshots(directory))
+        with self._locked(directory):
+            exited_path = os.path.join(directory, EXITED_SNAPSHOT)
+            exited = [path for path in self._snapshot_paths(directory) if _written_by_exited_worker(path)]
+            if exited:
+                folded = [without_gauges(self._read_snapshot(path)) for path in exited]
+                if os.path.exists(exited_path):
+                    folded.append(self._read_snapshot(exited_path))
+                with open(exited_path + '.tmp', 'w') as snapshot_file:
+                    json.dump(merge_snapshots(folded), snapshot_file)
+                os.replace(exited_path + '.tmp', exited_path)
+                for path in exited:
+                    os.remove(path)
+            return merge_snapshots(self._read_snapshots(directory))
+
+    @staticmethod
+    def _snapshot_paths(directory):
+        return [os.path.join(directory, filename) for filename in sorted(os.listdir(directory))
+                if filename.endswith('.json')]
+
+    @staticmethod
+    def _read_snapshot(path):
+        with open(path) as snapshot_file:
+            return json.load(snapshot_file)
+
+    def _read_snapshots(self, directory):
+        return [self._read_snapshot(path) for path in self._snapshot_paths(directory)]
+
+    def view(self):
+        return Response(render(self.collect()), mimetype='text/plain; version=0.0.4')
+
+
+class MetricsState(object):
+    """One app's instrumented engines, tracked caches and flush schedule."""
+
+    def __init__(self):
+        self.engines = {}
+        self.caches = {}
+        self.last_flush = 0.0
+        self.flush_lock = threading.Lock()
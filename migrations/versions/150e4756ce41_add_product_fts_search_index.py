@@ -0,0 +1,32 @@
+"""Add product_fts search index
+
+Revision ID: 150e4756ce41
+Revises: f5e5c07ace1f
+Create Date: 2026-10-18 10:03:17.284419
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '150e4756ce41'
+down_revision = 'f5e5c07ace1f'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    op.execute('CREATE VIRTUAL TABLE IF NOT EXISTS product_fts USING fts5(name, description)')
+    op.execute(
+        "INSERT INTO product_fts (rowid, name, description) "
+        "SELECT id, name, COALESCE(description, '') FROM product"
+    )
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    op.execute('DROP TABLE IF EXISTS product_fts')
@@ -0,0 +1,61 @@
+"""Store order totals and unit prices
+
+Revision ID: 1dc403122465
+Revises: 97b75075920b
+Create Date: 2026-10-18 13:41:08.617093
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1dc403122465'
+down_revision = '97b75075920b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # order.total_price was declared as a DateTime defaulting to utcnow, so
+    # what it holds is really the creation time: move it to created_at.
+    with op.batch_alter_table('order', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('created_at', sa.DateTime(), nullable=True))
+    op.execute('UPDATE "order" SET created_at = total_price')
+
+    with op.batch_alter_table('order_product', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('unit_price', sa.Numeric(precision=10, scale=2), nullable=True))
+    # Historical lines can only be priced at today's prices.
+    op.execute(
+        'UPDATE order_product SET unit_price = '
+        '(SELECT price FROM product WHERE product.id = order_product.product_id)'
+    )
+    op.execute('UPDATE order_product SET unit_price = 0 WHERE unit_price IS NULL')
+    with op.batch_alter_table('order_product', schema=None) as batch_op:
+        batch_op.alter_column('unit_price', existing_type=sa.Numeric(precision=10, scale=2), nullable=False)
+
+    op.execute('UPDATE "order" SET total_price = NULL')
+    with op.batch_alter_table('order', schema=None) as batch_op:
+        batch_op.alter_column('total_price', existing_type=sa.DateTime(),
+                              type_=sa.Numeric(precision=10, scale=2), existing_nullable=True)
+    op.execute(
+        'UPDATE "order" SET total_price = COALESCE((SELECT ROUND(SUM(unit_price * quantity), 2) '
+        'FROM order_product WHERE order_product.order_id = "order".id), 0)'
+    )
+    with op.batch_alter_table('order', schema=None) as batch_op:
+        batch_op.alter_column('total_price', existing_type=sa.Numeric(precision=10, scale=2), nullable=False)
+
+
+def downgrade():
+    with op.batch_alter_table('order', schema=None) as batch_op:
+        batch_op.alter_column('total_price', existing_type=sa.Numeric(precision=10, scale=2), nullable=True)
+    op.execute('UPDATE "order" SET total_price = NULL')
+    with op.batch_alter_table('order', schema=None) as batch_op:
+        batch_op.alter_column('total_price', existing_type=sa.Numeric(precision=10, scale=2),
+                              type_=sa.DateTime(), existing_nullable=True)
+    op.execute('UPDATE "order" SET total_price = created_at')
+    with op.batch_alter_table('order', schema=None) as batch_op:
+        batch_op.drop_column('created_at')
+
+    with op.batch_alter_table('order_product', schema=None) as batch_op:
+        batch_op.drop_column('unit_price')
@@ -0,0 +1,31 @@
+"""Add updated_at to cart
+
+Revision ID: e6f3c9a1b8d2
+Revises: d4b7a2e91c05
+Create Date: 2026-10-18 23:52:05.331476
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e6f3c9a1b8d2'
+down_revision = 'd4b7a2e91c05'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('cart', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('updated_at', sa.DateTime(), nullable=True))
+    op.execute('UPDATE cart SET updated_at = CURRENT_TIMESTAMP')
+    with op.batch_alter_table('cart', schema=None) as batch_op:
+        batch_op.alter_column('updated_at', existing_type=sa.DateTime(), nullable=False)
+        batch_op.create_index(batch_op.f('ix_cart_updated_at'), ['updated_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('cart', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_cart_updated_at'))
+        batch_op.drop_column('updated_at')
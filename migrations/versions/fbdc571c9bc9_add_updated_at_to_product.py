@@ -0,0 +1,29 @@
+"""Add updated_at to product
+
+Revision ID: fbdc571c9bc9
+Revises: 6f52b435945a
+Create Date: 2026-10-18 18:02:13.405117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'fbdc571c9bc9'
+down_revision = '6f52b435945a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('product', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('updated_at', sa.DateTime(), nullable=True))
+    op.execute('UPDATE product SET updated_at = CURRENT_TIMESTAMP')
+    with op.batch_alter_table('product', schema=None) as batch_op:
+        batch_op.alter_column('updated_at', existing_type=sa.DateTime(), nullable=False)
+
+
+def downgrade():
+    with op.batch_alter_table('product', schema=None) as batch_op:
+        batch_op.drop_column('updated_at')
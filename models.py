@@ -0,0 +1,191 @@
+from datetime import datetime
+
+from flask_login import UserMixin
+from sqlalchemy import DDL, event, text, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import object_session
+
+from extensions import RoutingSession, db
+
+
+class User(db.Model, UserMixin):
+    id = db.Column(db.Integer, primary_key=True)
+    username = db.Column(db.String(20), unique=True, nullable=False)
+    email = db.Column(db.String(120), unique=True, nullable=False)
+    password = db.Column(db.String(60), nullable=False)
+    orders = db.relationship('Order', backref='user', lazy=True)
+
+
+class Product(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    description = db.Column(db.Text, nullable=True)
+    price = db.Column(db.Float, nullable=False, index=True)
+    # Units on hand, or NULL for products whose stock is not tracked.
+    stock = db.Column(db.Integer, nullable=True)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+    orders = db.relationship('OrderItem', backref='product', lazy=True)
+
+    __table_args__ = (
+        db.CheckConstraint('stock >= 0', name='ck_product_stock_nonnegative'),
+    )
+
+# product_fts is an FTS5 index over product.name/description keyed by
+# product.id. It is created alongside the product table and kept in sync by
+# the mapper events below; bulk Query.update()/delete() bypass them.
+event.listen(Product.__table__, 'after_create', DDL(
+    'CREATE VIRTUAL TABLE IF NOT EXISTS product_fts USING fts5(name, description)'
+).execute_if(dialect='sqlite'))
+event.listen(Product.__table__, 'before_drop', DDL(
+    'DROP TABLE IF EXISTS product_fts'
+).execute_if(dialect='sqlite'))
+
+@event.listens_for(Product, 'after_insert')
+def index_product(mapper, connection, product):
+    if connection.dialect.name == 'sqlite':
+        connection.execute(
+            text('INSERT INTO product_fts (rowid, name, description) VALUES (:id, :name, :description)'),
+            {'id': product.id, 'name': product.name, 'description': product.description or ''})
+
+@event.listens_for(Product, 'after_update')
+def reindex_product(mapper, connection, product):
+    unindex_product(mapper, connection, product)
+    index_product(mapper, connection, product)
+
+@event.listens_for(Product, 'after_delete')
+def unindex_product(mapper, connection, product):
+    if connection.dialect.name == 'sqlite':
+        connection.execute(text('DELETE FROM product_fts WHERE rowid = :id'), {'id': product.id})
+
+class CatalogVersion(db.Model):
+    """A single row counting writes to the product catalog.
+
+    Every flush that inserts, updates or deletes a Product bumps ``version``
+    in the same transaction, so all workers agree on it. It keys the cached
+    catalog pages and the catalog's ETags.
+    """
+    __tablename__ = 'catalog_version'
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+event.listen(CatalogVersion.__table__, 'after_create', DDL(
+    'INSERT INTO catalog_version (id, version, updated_at) VALUES (1, 0, CURRENT_TIMESTAMP)'
+))
+
+def bump_catalog_version(connection):
+    """Record a catalog change. Call this after bulk Product statements too."""
+    connection.execute(update(CatalogVersion).where(CatalogVersion.id == 1)
+                       .values(version=CatalogVersion.version + 1, updated_at=datetime.utcnow()))
+
+@event.listens_for(Product, 'after_insert')
+@event.listens_for(Product, 'after_update')
+@event.listens_for(Product, 'after_delete')
+def mark_catalog_changed(mapper, connection, product):
+    session = object_session(product)
+    if not session.info.get('catalog_bumped'):
+        session.info['catalog_bumped'] = True
+        bump_catalog_version(connection)
+
+@event.listens_for(RoutingSession, 'after_flush')
+def reset_catalog_bump(session, flush_context):
+    session.info.pop('catalog_bumped', None)
+
+class Order(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    items = db.relationship('OrderItem', backref='order', lazy=True)
+    total_price = db.Column(db.Numeric(10, 2), nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    products = db.relationship('OrderProduct', backref='order', lazy=True)
+
+    # Order history lists a user's orders newest first.
+    __table_args__ = (
+        db.Index('ix_order_user_id_id', 'user_id', 'id'),
+    )
+
+class OrderProduct(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    order_id = db.Column(db.Integer, db.ForeignKey('order.id'), nullable=False, index=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False, index=True)
+    quantity = db.Column(db.Integer, nullable=False)
+    # Price of one unit at checkout, so later price changes don't rewrite history.
+    unit_price = db.Column(db.Numeric(10, 2), nullable=False)
+
+    product = db.relationship('Product', backref='order_products')
+
+
+class OrderItem(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    order_id = db.Column(db.Integer, db.ForeignKey('order.id'), nullable=False, index=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False, index=True)
+    quantity = db.Column(db.Integer, nullable=False)
+
+class Cart(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False, index=True)
+    quantity = db.Column(db.Integer, nullable=False, default=1)
+    # Last time the line was added to or changed; carts idle for CART_TTL are swept.
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow,
+                           index=True)
+
+    product = db.relationship('Product', backref='carts')
+    user = db.relationship('User', backref='carts')
+
+    __table_args__ = (
+        db.Index('ix_cart_user_id_product_id', 'user_id', 'product_id', unique=True),
+    )
+
+class StockReservation(db.Model):
+    """Units taken out of a product's stock while a user pays for them.
+
+    Reserving decrements Product.stock straight away. Placing the order turns
+    the user's reservations into the sale; otherwise the sweeper puts the
+    units back once ``expires_at`` has passed.
+    """
+    __tablename__ = 'stock_reservation'
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False, index=True)
+    quantity = db.Column(db.Integer, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+class PaymentIntent(db.Model):
+    # A random id so clients can poll it without being able to guess others.
+    id = db.Column(db.String(32), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    status = db.Column(db.String(16), nullable=False, default='pending')
+    total_price = db.Column(db.Numeric(10, 2), nullable=False)
+    payment_id = db.Column(db.String(64), nullable=True)
+    approval_url = db.Column(db.Text, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class OutboxMessage(db.Model):
+    """An email waiting to be sent, written in the transaction that caused it.
+
+    ``template`` is rendered with the JSON ``payload`` when the message is
+    sent. ``next_attempt_at`` is pushed back on every failed attempt and set
+    to NULL once MAIL_MAX_ATTEMPTS is reached; sent messages are deleted.
+    """
+    __tablename__ = 'outbox_message'
+    id = db.Column(db.Integer, primary_key=True)
+    recipient = db.Column(db.String(120), nullable=False)
+    subject = db.Column(db.String(200), nullable=False)
+    template = db.Column(db.String(100), nullable=False)
+    payload = db.Column(db.Text, nullable=False, default='{}')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=True, default=datetime.utcnow, index=True)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+def is_valid_id(value):
+    """Return whether ``value`` fits an integer primary key, so binding it cannot overflow."""
+    return 0 < value < 2 ** 63
+
+def upsert(model):
+    """Return an INSERT for ``model`` that supports ``on_conflict_do_update``."""
+    if db.engine.dialect.name == 'postgresql':
+        return postgresql.insert(model)
+    return sqlite.insert(model)
@@ -0,0 +1,224 @@
+"""Payment gateways and the background queue that calls them.
+
+Creating a PayPal payment is a remote round trip that can take seconds, so
+checkout only records a payment intent and hands the gateway call to a small
+worker pool. The browser then polls the intent until the approval URL is
+ready. Gateways share one interface, so the PayPal SDK can be pointed at
+FakePayPalServer to exercise the whole flow offline.
+"""
+import itertools
+import json
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from flask import current_app
+
+PaymentResult = namedtuple('PaymentResult', ['payment_id', 'approval_url'])
+
+
+class PaymentError(Exception):
+    """Raised when a gateway fails to create a payment."""
+
+
+class QueueFull(Exception):
+    """Raised when the payment job queue cannot take more work."""
+
+
+class PaymentGateway(object):
+    """Interface for creating payments with a remote provider."""
+
+    def create_payment(self, payload):
+        """Create a payment from a PayPal-style ``payload`` and return a PaymentResult."""
+        raise NotImplementedError
+
+
+class PayPalGateway(PaymentGateway):
+    """Creates payments through paypalrestsdk, with a timeout on every HTTP call."""
+
+    def __init__(self, mode, client_id, client_secret, endpoint=None, timeout=10):
+        import paypalrestsdk
+
+        class TimeoutApi(paypalrestsdk.Api):
+            def http_call(self, url, method, **kwargs):
+                kwargs.setdefault('timeout', timeout)
+                return super(TimeoutApi, self).http_call(url, method, **kwargs)
+
+        options = {'mode': mode, 'client_id': client_id, 'client_secret': client_secret}
+        if endpoint:
+            options['endpoint'] = endpoint
+        self.api = TimeoutApi(options)
+        self.payment_class = paypalrestsdk.Payment
+
+    def create_payment(self, payload):
+        payment = self.payment_class(payload, api=self.api)
+        try:
+            created = payment.create()
+        except Exception as error:
+            raise PaymentError(str(error))
+        if not created:
+            raise PaymentError(str(payment.error))
+        for link in payment.links:
+            if link.method == 'REDIRECT':
+                return PaymentResult(payment.id, str(link.href))
+        raise PaymentError('PayPal returned no approval link for payment %s' % payment.id)
+
+
+class JobQueue(object):
+    """A bounded thread pool for background jobs.
+
+    At most ``workers + queue_size`` jobs are running or waiting; submitting
+    more raises QueueFull instead of building an unbounded backlog.
+    """
+
+    def __init__(self, workers=4, queue_size=64, name='jobs'):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise QueueFull()
+        try:
+            future = self._executor.submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._pending.add(future)
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future):
+        with self._lock:
+            self._pending.discard(future)
+        self._slots.release()
+
+    def join(self, timeout=None):
+        """Wait for every job submitted so far to finish."""
+        with self._lock:
+            pending = list(self._pending)
+        wait(pending, timeout=timeout)
+
+
+class Payments(object):
+    """Flask extension giving each app its own gateway and job queue.
+
+    The state lives in ``app.extensions['payments']``, so apps built with
+    different configs never share a queue or a gateway. The gateway, and
+    with it the PayPal SDK, is created on first use, so processes that never
+    take a payment do not pay to import it.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('PAYMENT_GATEWAY', 'paypal')
+        app.config.setdefault('PAYPAL_MODE', 'sandbox')
+        app.config.setdefault('PAYPAL_ENDPOINT', None)
+        app.config.setdefault('PAYPAL_TIMEOUT', 10)
+        app.config.setdefault('PAYMENT_WORKERS', 4)
+        app.config.setdefault('PAYMENT_QUEUE_SIZE', 64)
+        app.extensions['payments'] = PaymentsState(app.config)
+
+    def get_gateway(self):
+        """Return the current app's gateway, creating it on first use."""
+        return current_app.extensions['payments'].get_gateway()
+
+    def submit(self, fn, *args):
+        return current_app.extensions['payments'].queue.submit(fn, *args)
+
+
+class PaymentsState(object):
+    """One app's gateway and job queue."""
+
+    def __init__(self, config):
+        self.config = config
+        self.gateway = None
+        self.fake_server = None
+        self.queue = JobQueue(config['PAYMENT_WORKERS'], config['PAYMENT_QUEUE_SIZE'], name='payments')
+        self._lock = threading.Lock()
+
+    def get_gateway(self):
+        with self._lock:
+            if self.gateway is None:
+                endpoint = self.config['PAYPAL_ENDPOINT']
+                if self.config['PAYMENT_GATEWAY'] == 'fake':
+                    self.fake_server = FakePayPalServer().start()
+                    endpoint = self.fake_server.url
+                self.gateway = PayPalGateway(self.config['PAYPAL_MODE'], self.config['PAYPAL_CLIENT_ID'],
+                                             self.config['PAYPAL_CLIENT_SECRET'], endpoint=endpoint,
+                                             timeout=self.config['PAYPAL_TIMEOUT'])
+            return self.gateway
+
+
+class FakePayPalServer(object):
+    """A local stand-in for the PayPal REST API.
+
+    It implements just enough of ``/v1/oauth2/token`` and
+    ``/v1/payments/payment`` for paypalrestsdk to create payments. Every
+    request sleeps for ``latency`` seconds to mimic the remote round trip.
+    Created payloads are kept in ``payments`` for inspection.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0):
+        self.latency = latency
+        self.payments = []
+        self._ids = itertools.count(1)
+        self._httpd = ThreadingHTTPServer((host, port), self._handler())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return 'http://%s:%d' % (host, port)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name='fake-paypal', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                time.sleep(server.latency)
+                if self.path == '/v1/oauth2/token':
+                    self._reply(200, {'access_token': 'fake-token', 'token_type': 'Bearer', 'expires_in': 32400})
+                elif self.path == '/v1/payments/payment':
+                    payment = json.loads(body)
+                    payment_id = 'PAY-FAKE%d' % next(server._ids)
+                    server.payments.append(payment)
+                    payment.update({'id': payment_id, 'state': 'created', 'links': [{
+                        'href': '%s/checkoutnow?token=%s' % (server.url, payment_id),
+                        'rel': 'approval_url',
+                        'method': 'REDIRECT',
+                    }]})
+                    self._reply(201, payment)
+                else:
+                    self._reply(404, {'name': 'NOT_FOUND'})
+
+            def _reply(self, status, document):
+                data = json.dumps(document).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
@@ -1,13 +1,67 @@
+import asyncio
+import json
+import os
+import re
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
 import unittest
-from main import app, db, User, Product, LoginForm
+from unittest.mock import Mock, patch
+from decimal import Decimal
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+from sqlalchemy import PrimaryKeyConstraint, UniqueConstraint, create_engine, event, text
+from sqlalchemy.exc import OperationalError
+
+from flask import Flask, url_for
+from flask.testing import FlaskClient
+from jinja2 import FileSystemBytecodeCache
+
+from assets import Assets, build
+from cache import SQLiteCache, TTLCache
+from hashing import HashingBusy, PasswordHasher
+from instrumentation import QueryBudgetExceeded
+from mail import DebuggingSMTPServer, Mailer, SMTPPool
+from metrics import Registry
+from payments import FakePayPalServer, PayPalGateway, PaymentError, PaymentResult, QueueFull
+from application import _dispose_forked_engines, _forked_engines, create_app, precompile_templates
+from extensions import apply_sqlite_pragmas, db, engine_options, mailer, password_hasher
+from forms import LoginForm
+from models import Cart, Order, OrderProduct, OutboxMessage, Product, StockReservation, User
+from views.auth import USER_CACHED_COLUMNS, load_user
+from views.catalog import paginate_products, search_products
+from views.cart import sweep_expired_carts
+from views.inventory import release_expired_reservations
+from views.outbox import drain_outbox
+
+app = create_app()
+user_cache = app.extensions['user_cache']
+catalog_cache = app.extensions['catalog_cache']
+
+class BufferedClient(FlaskClient):
+    """Reads streamed responses to the end, as a WSGI server would."""
+
+    def open(self, *args, **kwargs):
+        kwargs.setdefault('buffered', True)
+        return super(BufferedClient, self).open(*args, **kwargs)
 
 class TestApp(unittest.TestCase):
 
 
     def setUp(self):
         app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False
+        app.config['MAIL_SEND_IN_BACKGROUND'] = False
         app.config['SQlALchemy_DATABSE_URI'] = 'sqlite:///:memory:'
+        app.test_client_class = BufferedClient
         self.app = app.test_client()
+        user_cache.clear()
+        catalog_cache.clear()
 
         with app.app_context():
             db.create_all()
@@ -16,7 +70,7 @@ class TestApp(unittest.TestCase):
     def tearDown(self):
         with app.app_context():
             db.session.remove()
-            db.drop_all
+            db.drop_all()
 
     def test_home_page(self):
         response = self.app.get('/')
@@ -28,6 +82,951 @@ class TestApp(unittest.TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertIn(b'Products', response.data)
 
+    def login(self, username='shopper'):
+        with app.app_context():
+            user = User(username=username, email='%s@example.com' % username, password='unused')
+            db.session.add(user)
+            db.session.commit()
+            user_id = user.id
+        with self.app.session_transaction() as session:
+            session['_user_id'] = str(user_id)
+            session['_fresh'] = True
+        return user_id
+
+    @contextmanager
+    def count_queries(self):
+        statements = []
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+        with app.app_context():
+            engine = db.engine
+        event.listen(engine, 'before_cursor_execute', record)
+        try:
+            yield statements
+        finally:
+            event.remove(engine, 'before_cursor_execute', record)
+
+    def fill_cart(self, user_id, lines):
+        self.add_products([float(i + 1) for i in range(lines)])
+        with app.app_context():
+            db.session.add_all([Cart(user_id=user_id, product_id=i + 1, quantity=2) for i in range(lines)])
+            db.session.commit()
+
+    def add_products(self, prices):
+        with app.app_context():
+            db.session.add_all([Product(name='Product %d' % i, price=price) for i, price in enumerate(prices)])
+            db.session.commit()
+
+    def test_paginate_products_walks_catalog_by_cursor(self):
+        self.add_products([5.0, 1.0, 3.0, 2.0, 4.0])
+        with app.app_context():
+            first = paginate_products(per_page=2)
+            self.assertEqual([p.id for p in first.items], [1, 2])
+            self.assertIsNone(first.prev_cursor)
+
+            second = paginate_products(after=first.next_cursor, per_page=2)
+            self.assertEqual([p.id for p in second.items], [3, 4])
+
+            last = paginate_products(after=second.next_cursor, per_page=2)
+            self.assertEqual([p.id for p in last.items], [5])
+            self.assertIsNone(last.next_cursor)
+
+            back = paginate_products(before=last.prev_cursor, per_page=2)
+            self.assertEqual([p.id for p in back.items], [3, 4])
+
+    def test_paginate_products_by_price(self):
+        self.add_products([5.0, 1.0, 3.0, 3.0, 4.0])
+        with app.app_context():
+            first = paginate_products(sort='price', per_page=3)
+            self.assertEqual([p.price for p in first.items], [1.0, 3.0, 3.0])
+            second = paginate_products(sort='price', after=first.next_cursor, per_page=3)
+            self.assertEqual([p.price for p in second.items], [4.0, 5.0])
+            self.assertIsNone(second.next_cursor)
+
+    def test_products_page_links_to_next_page(self):
+        self.add_products([1.0, 2.0, 3.0])
+        response = self.app.get('/products?per_page=2')
+        self.assertIn(b'Product 1', response.data)
+        self.assertNotIn(b'Product 2', response.data)
+        self.assertIn(b'after=2', response.data)
+
+        response = self.app.get('/products?per_page=2&after=2')
+        self.assertIn(b'Product 2', response.data)
+
+    def test_products_page_rejects_bad_cursor(self):
+        for query in ('after=nope', 'after=' + '9' * 25, 'after=0', 'sort=price&after=nan:1',
+                      'sort=price&after=1e400:1', 'sort=price&after=5.0:-1'):
+            response = self.app.get('/products?' + query)
+            self.assertEqual(response.status_code, 400, query)
+
+    def test_search_ranks_name_matches_first(self):
+        with app.app_context():
+            db.session.add_all([
+                Product(name='Wool scarf', description='Pairs with any linen shirt', price=20.0),
+                Product(name='Linen shirt', description='Breathable summer shirt', price=35.0),
+            ])
+            db.session.commit()
+            self.assertEqual([p.name for p in search_products('linen')], ['Linen shirt', 'Wool scarf'])
+            self.assertEqual([p.name for p in search_products('lin')], ['Linen shirt', 'Wool scarf'])
+            self.assertEqual(search_products('"*)'), [])
+
+    def test_search_index_follows_product_changes(self):
+        with app.app_context():
+            product = Product(name='Denim jacket', price=60.0)
+            db.session.add(product)
+            db.session.commit()
+
+            product.name = 'Corduroy jacket'
+            db.session.commit()
+            self.assertEqual(search_products('denim'), [])
+            self.assertEqual([p.name for p in search_products('corduroy')], ['Corduroy jacket'])
+
+            db.session.delete(product)
+            db.session.commit()
+            self.assertEqual(search_products('jacket'), [])
+
+    def test_search_page(self):
+        self.add_products([10.0])
+        response = self.app.get('/search?q=product')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Product 0', response.data)
+
+    def test_add_to_cart_upserts_single_line(self):
+        user_id = self.login()
+        self.add_products([10.0])
+        self.app.post('/add_to_cart/1', data={'quantity': 2})
+        response = self.app.post('/add_to_cart/1', data={'quantity': 3})
+        self.assertEqual(response.status_code, 302)
+        with app.app_context():
+            lines = Cart.query.filter_by(user_id=user_id).all()
+            self.assertEqual([(line.product_id, line.quantity) for line in lines], [(1, 5)])
+
+    def test_add_to_cart_unknown_product(self):
+        self.login()
+        response = self.app.post('/add_to_cart/42')
+        self.assertEqual(response.status_code, 404)
+        with app.app_context():
+            self.assertEqual(Cart.query.count(), 0)
+
+    def test_add_to_cart_rejects_out_of_range_values(self):
+        self.add_products([10.0])
+        self.login()
+        self.assertEqual(self.app.post('/add_to_cart/1', data={'quantity': 10 ** 20}).status_code, 400)
+        self.assertEqual(self.app.post('/add_to_cart/' + '9' * 25).status_code, 404)
+        with app.app_context():
+            self.assertEqual(Cart.query.count(), 0)
+
+    def test_anonymous_cart_lives_in_session_without_db_writes(self):
+        self.add_products([10.0, 20.0])
+        with self.count_queries() as statements:
+            self.app.post('/add_to_cart/1', data={'quantity': 2})
+            self.app.post('/add_to_cart/2')
+            self.app.post('/add_to_cart/1')
+            self.assertEqual(self.app.post('/add_to_cart/42').status_code, 404)
+        self.assertEqual([s for s in statements if not s.lstrip().upper().startswith('SELECT')], [])
+        with self.app.session_transaction() as session:
+            self.assertEqual(session['cart'], {'1': 3, '2': 1})
+
+        with patch.dict(app.config, SESSION_CART_MAX_LINES=2):
+            self.add_products([30.0])
+            self.app.post('/add_to_cart/3')
+        with self.app.session_transaction() as session:
+            self.assertEqual(session['cart'], {'1': 3, '2': 1})
+
+    def test_login_merges_session_cart_with_one_upsert(self):
+        self.add_products([10.0, 20.0, 30.0])
+        with app.app_context():
+            user = User(username='shopper', email='shopper@example.com', password=password_hasher.hash('secret'))
+            db.session.add(user)
+            db.session.flush()
+            db.session.add(Cart(user_id=user.id, product_id=1, quantity=1))
+            db.session.commit()
+            user_id = user.id
+        self.app.post('/add_to_cart/1', data={'quantity': 2})
+        self.app.post('/add_to_cart/3')
+        with app.app_context():
+            db.session.delete(db.session.get(Product, 3))
+            db.session.commit()
+
+        with self.count_queries() as statements:
+            response = self.app.post('/login', data={'email': 'shopper@example.com', 'password': 'secret'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(len([s for s in statements if s.lstrip().upper().startswith('INSERT')]), 1)
+        with app.app_context():
+            lines = Cart.query.filter_by(user_id=user_id).order_by(Cart.product_id).all()
+            self.assertEqual([(line.product_id, line.quantity) for line in lines], [(1, 3)])
+        with self.app.session_transaction() as session:
+            self.assertNotIn('cart', session)
+
+    def test_session_cart_quantities_are_bounded(self):
+        self.add_products([10.0])
+        self.assertEqual(self.app.post('/add_to_cart/1', data={'quantity': 10 ** 20}).status_code, 400)
+        self.assertEqual(self.app.post('/add_to_cart/' + '9' * 25).status_code, 404)
+        for _ in range(2):
+            self.app.post('/add_to_cart/1', data={'quantity': app.config['CART_API_MAX_AMOUNT']})
+        with self.app.session_transaction() as session:
+            self.assertEqual(session['cart'], {'1': app.config['CART_API_MAX_AMOUNT']})
+            session['cart'] = {'1': 10 ** 20, '9' * 25: 1, 'x': 1}
+
+        with app.app_context():
+            user = User(username='shopper', email='shopper@example.com', password=password_hasher.hash('secret'))
+            db.session.add(user)
+            db.session.commit()
+            user_id = user.id
+        response = self.app.post('/login', data={'email': 'shopper@example.com', 'password': 'secret'})
+        self.assertEqual(response.status_code, 302)
+        with app.app_context():
+            lines = Cart.query.filter_by(user_id=user_id).all()
+            self.assertEqual([(line.product_id, line.quantity) for line in lines],
+                             [(1, app.config['CART_API_MAX_AMOUNT'])])
+
+    def test_patch_cart_applies_operations_in_one_upsert(self):
+        user_id = self.login()
+        self.fill_cart(user_id, 2)
+        self.add_products([5.0])
+        operations = [
+            {'product_id': 1, 'delta': 3},
+            {'product_id': 2, 'quantity': 0},
+            {'product_id': 3, 'delta': 1},
+            {'product_id': 3, 'delta': 1},
+            {'product_id': 42, 'quantity': 1},
+        ]
+        with self.count_queries() as statements:
+            response = self.app.patch('/api/cart', json=operations)
+        self.assertEqual(response.status_code, 200)
+        writes = [s.lstrip().split()[0].upper() for s in statements if not s.lstrip().upper().startswith('SELECT')]
+        self.assertEqual(writes, ['INSERT', 'DELETE'])
+        self.assertEqual(response.json['items'], [
+            {'product_id': 1, 'name': 'Product 0', 'price': 1.0, 'quantity': 5, 'subtotal': 5.0},
+            {'product_id': 3, 'name': 'Product 0', 'price': 5.0, 'quantity': 2, 'subtotal': 10.0},
+        ])
+        self.assertEqual((response.json['quantity'], response.json['total']), (7, 15.0))
+
+        response = self.app.patch('/api/cart', json=[{'product_id': 1, 'delta': -5}, {'product_id': 3, 'quantity': 4}])
+        self.assertEqual([(item['product_id'], item['quantity']) for item in response.json['items']], [(3, 4)])
+        with app.app_context():
+            self.assertEqual([(line.product_id, line.quantity) for line in Cart.query.all()], [(3, 4)])
+
+    def test_patch_cart_rejects_malformed_operations(self):
+        self.login()
+        for body in ([], {'product_id': 1}, [{'product_id': 1}], [{'product_id': '1', 'delta': 1}],
+                     [{'product_id': 1, 'quantity': -1}], [{'product_id': 1, 'delta': 1, 'quantity': 2}],
+                     [{'product_id': 1, 'delta': 10 ** 20}], [{'product_id': 1, 'quantity': 10 ** 20}],
+                     [{'product_id': 10 ** 20, 'delta': 1}], [{'product_id': 0, 'delta': 1}]):
+            response = self.app.patch('/api/cart', json=body)
+            self.assertEqual(response.status_code, 400, body)
+            self.assertIn('error', response.json)
+
+    def test_patch_cart_edits_session_cart_for_anonymous_shoppers(self):
+        self.add_products([10.0, 20.0])
+        self.app.post('/add_to_cart/1')
+        with self.count_queries() as statements:
+            response = self.app.patch('/api/cart', json=[{'product_id': 1, 'delta': 2}, {'product_id': 2, 'quantity': 1},
+                                                         {'product_id': 42, 'quantity': 1}])
+        self.assertEqual([s for s in statements if not s.lstrip().upper().startswith('SELECT')], [])
+        self.assertEqual((response.json['quantity'], response.json['total']), (4, 50.0))
+        with self.app.session_transaction() as session:
+            self.assertEqual(session['cart'], {'1': 3, '2': 1})
+
+        with patch.dict(app.config, SESSION_CART_MAX_LINES=1):
+            response = self.app.patch('/api/cart', json=[{'product_id': 1, 'delta': 1}])
+        self.assertEqual(response.status_code, 409)
+
+    def test_cart_updates_refresh_updated_at(self):
+        user_id = self.login()
+        self.add_products([10.0])
+        self.app.post('/add_to_cart/1')
+        with app.app_context():
+            db.session.execute(db.update(Cart).values(updated_at=datetime(2020, 1, 1)))
+            db.session.commit()
+        self.app.patch('/api/cart', json=[{'product_id': 1, 'delta': 1}])
+        with app.app_context():
+            self.assertGreater(Cart.query.filter_by(user_id=user_id).one().updated_at, datetime(2020, 1, 2))
+
+    def test_sweeper_deletes_expired_carts_in_batches(self):
+        now = datetime.utcnow()
+        stale, fresh = now - timedelta(days=31), now - timedelta(days=1)
+        self.add_products([1.0] * 3)
+        with app.app_context():
+            users = [User(username='u%d' % i, email='u%d@example.com' % i, password='x') for i in range(3)]
+            db.session.add_all(users)
+            db.session.flush()
+            db.session.add_all([Cart(user_id=users[0].id, product_id=i, quantity=1, updated_at=stale) for i in (1, 2, 3)])
+            # A cart with one recent line is kept whole.
+            db.session.add_all([Cart(user_id=users[1].id, product_id=1, quantity=1, updated_at=stale),
+                                Cart(user_id=users[1].id, product_id=2, quantity=1, updated_at=fresh)])
+            db.session.add(Cart(user_id=users[2].id, product_id=1, quantity=1, updated_at=stale))
+            db.session.commit()
+
+            with patch.dict(app.config, CART_TTL=30 * 24 * 60 * 60), self.count_queries() as statements:
+                self.assertEqual(sweep_expired_carts(now, batch_size=2), 4)
+            self.assertEqual(len([s for s in statements if s.lstrip().upper().startswith('DELETE')]), 3)
+            self.assertEqual(sorted((line.user_id, line.product_id) for line in Cart.query.all()),
+                             [(users[1].id, 1), (users[1].id, 2)])
+
+        metrics_text = self.app.get('/metrics').get_data(as_text=True)
+        self.assertIn('cart_lines 2', metrics_text)
+        self.assertRegex(metrics_text, r'cart_lines_swept_total [1-9]')
+
+    def test_review_order_query_count_is_fixed(self):
+        self.fill_cart(self.login('small'), 1)
+        with self.count_queries() as small:
+            response = self.app.get('/review_order')
+        self.assertIn(b'Total: $2.00', response.data)
+
+        user_id = self.login('large')
+        with app.app_context():
+            db.session.add_all([Cart(user_id=user_id, product_id=i, quantity=1) for i in range(2, 6)])
+            db.session.add_all([Product(name='Extra %d' % i, price=1.0) for i in range(4)])
+            db.session.commit()
+        with self.count_queries() as large:
+            response = self.app.get('/review_order')
+        self.assertIn(b'Total: $4.00', response.data)
+
+        # load_user, the cart lines with their products, and the total.
+        self.assertEqual(len(small), 3)
+        self.assertEqual(len(large), 3)
+
+    def test_confirm_order_moves_cart_into_order(self):
+        user_id = self.login()
+        self.fill_cart(user_id, 3)
+        response = self.app.post('/confirm_order')
+        self.assertEqual(response.status_code, 302)
+        with app.app_context():
+            self.assertEqual(Cart.query.count(), 0)
+            order = Order.query.filter_by(user_id=user_id).one()
+            self.assertEqual(sorted((line.product_id, line.quantity) for line in order.products),
+                             [(1, 2), (2, 2), (3, 2)])
+
+    def test_confirm_order_statement_count_is_fixed(self):
+        self.fill_cart(self.login('small'), 1)
+        with self.count_queries() as small:
+            self.app.post('/confirm_order')
+
+        user_id = self.login('large')
+        with app.app_context():
+            db.session.add_all([Product(name='Bulk %d' % i, price=1.0) for i in range(50)])
+            db.session.add_all([Cart(user_id=user_id, product_id=i, quantity=1) for i in range(2, 52)])
+            db.session.commit()
+        with self.count_queries() as large:
+            self.app.post('/confirm_order')
+
+        self.assertEqual(len(small), len(large))
+        with app.app_context():
+            self.assertEqual(OrderProduct.query.count(), 51)
+            self.assertEqual(Cart.query.count(), 0)
+
+    def test_confirm_order_with_empty_cart(self):
+        self.login()
+        response = self.app.post('/confirm_order')
+        self.assertEqual(response.status_code, 302)
+        self.assertIn('/review_order', response.location)
+        with app.app_context():
+            self.assertEqual(Order.query.count(), 0)
+
+    def test_confirm_order_stores_total_and_unit_prices(self):
+        user_id = self.login()
+        self.fill_cart(user_id, 2)
+        self.app.post('/confirm_order')
+        with app.app_context():
+            Product.query.update({Product.price: 100.0})
+            db.session.commit()
+            order = Order.query.filter_by(user_id=user_id).one()
+            self.assertEqual(order.total_price, Decimal('6.00'))
+            self.assertEqual(sorted(line.unit_price for line in order.products), [Decimal('1.00'), Decimal('2.00')])
+
+        response = self.app.get('/orders')
+        self.assertIn(b'Total: $6.00', response.data)
+
+    def set_stock(self, stock):
+        with app.app_context():
+            for product_id, units in stock.items():
+                db.session.get(Product, product_id).stock = units
+            db.session.commit()
+
+    def stock(self):
+        with app.app_context():
+            return dict(db.session.execute(db.select(Product.id, Product.stock).order_by(Product.id)).all())
+
+    def test_confirm_order_takes_stock_and_never_oversells(self):
+        self.fill_cart(self.login('first'), 2)
+        self.set_stock({1: 3})
+        self.app.post('/confirm_order')
+        self.assertEqual(self.stock(), {1: 1, 2: None})
+
+        user_id = self.login('second')
+        with app.app_context():
+            db.session.add_all([Cart(user_id=user_id, product_id=1, quantity=2),
+                                Cart(user_id=user_id, product_id=2, quantity=1)])
+            db.session.commit()
+        response = self.app.post('/confirm_order')
+        self.assertIn('/review_order', response.location)
+        self.assertEqual(self.stock(), {1: 1, 2: None})
+        with app.app_context():
+            self.assertEqual(Order.query.filter_by(user_id=user_id).count(), 0)
+            self.assertEqual(Cart.query.filter_by(user_id=user_id).count(), 2)
+
+    def test_checkout_reserves_stock_until_order_or_expiry(self):
+        user_id = self.login()
+        self.fill_cart(user_id, 2)
+        self.set_stock({1: 5, 2: 2})
+        created = Mock(create_payment=Mock(return_value=PaymentResult('PAY-1', 'https://paypal.test/approve')))
+        with patch.object(app.extensions['payments'], 'gateway', created):
+            self.app.post('/checkout')
+            self.app.post('/checkout')
+            app.extensions['payments'].queue.join(timeout=10)
+        # Checking out again replaces the reservation instead of adding to it.
+        self.assertEqual(self.stock(), {1: 3, 2: 0})
+
+        with patch.object(app.extensions['payments'], 'gateway', created):
+            response = self.app.post('/checkout')
+            app.extensions['payments'].queue.join(timeout=10)
+        self.assertEqual(response.status_code, 202)
+        self.app.post('/confirm_order')
+        self.assertEqual(self.stock(), {1: 3, 2: 0})
+        with app.app_context():
+            self.assertEqual(StockReservation.query.count(), 0)
+
+        with app.app_context():
+            db.session.add(Cart(user_id=user_id, product_id=1, quantity=2))
+            db.session.commit()
+        with patch.object(app.extensions['payments'], 'gateway', created):
+            self.app.post('/checkout')
+            app.extensions['payments'].queue.join(timeout=10)
+        self.assertEqual(self.stock(), {1: 1, 2: 0})
+        with app.app_context():
+            self.assertEqual(release_expired_reservations(), 0)
+            self.assertEqual(release_expired_reservations(now=datetime.utcnow() + timedelta(hours=1), batch_size=1), 1)
+        self.assertEqual(self.stock(), {1: 3, 2: 0})
+
+    def test_failed_payments_release_reserved_stock(self):
+        user_id = self.login()
+        self.fill_cart(user_id, 2)
+        self.set_stock({1: 5, 2: 2})
+        failing = Mock(create_payment=Mock(side_effect=PaymentError('declined')))
+        with patch.object(app.extensions['payments'], 'gateway', failing):
+            response = self.app.post('/checkout')
+            app.extensions['payments'].queue.join(timeout=10)
+        self.assertEqual(self.app.get(response.json['status_url']).json['status'], 'failed')
+        self.assertEqual(self.stock(), {1: 5, 2: 2})
+
+        with patch.object(app.extensions['payments'].queue, 'submit', side_effect=QueueFull()):
+            response = self.app.post('/checkout')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(self.stock(), {1: 5, 2: 2})
+        with app.app_context():
+            self.assertEqual(StockReservation.query.count(), 0)
+
+    def test_checkout_refuses_products_out_of_stock(self):
+        user_id = self.login()
+        self.fill_cart(user_id, 2)
+        self.set_stock({1: 1, 2: 10})
+        response = self.app.post('/checkout')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json['product_ids'], [1])
+        self.assertEqual(self.stock(), {1: 1, 2: 10})
+        with app.app_context():
+            self.assertEqual(StockReservation.query.count(), 0)
+
+    def smtp_server(self):
+        server = DebuggingSMTPServer().start()
+        self.addCleanup(server.stop)
+        pool = SMTPPool(*server.address, timeout=5)
+        self.addCleanup(pool.close)
+        patcher = patch.object(app.extensions['mailer'], 'pool', pool)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return server
+
+    def test_confirm_order_writes_email_to_outbox(self):
+        self.fill_cart(self.login(), 2)
+        with patch.object(mailer, 'get_pool') as get_pool:
+            self.app.post('/confirm_order')
+        get_pool.assert_not_called()
+        with app.app_context():
+            message = OutboxMessage.query.one()
+            order = Order.query.one()
+            self.assertEqual(message.recipient, 'shopper@example.com')
+            self.assertEqual(json.loads(message.payload), {'order_id': order.id})
+
+    def test_outbox_is_sent_in_batches_over_one_connection(self):
+        server = self.smtp_server()
+        for username in ('ann', 'bob', 'cy'):
+            user_id = self.login(username)
+            with app.app_context():
+                product = Product(name='Shirt for %s' % username, price=12.5)
+                db.session.add(product)
+                db.session.flush()
+                db.session.add(Cart(user_id=user_id, product_id=product.id, quantity=2))
+                db.session.commit()
+            self.app.post('/confirm_order')
+
+        with patch.dict(app.config, MAIL_BATCH_SIZE=2), app.app_context():
+            drain_outbox()
+            self.assertEqual(OutboxMessage.query.count(), 0)
+        self.assertEqual(server.connections, 1)
+        self.assertEqual([message['To'] for message in server.messages],
+                         ['ann@example.com', 'bob@example.com', 'cy@example.com'])
+        body = server.messages[0].get_content()
+        self.assertIn('2 x Shirt for ann @ $12.50', body)
+        self.assertIn('Total: $25.00', body)
+
+    def test_outbox_retries_with_backoff_then_gives_up(self):
+        server = self.smtp_server()
+        server.fail_next = 1
+        self.fill_cart(self.login(), 1)
+        self.app.post('/confirm_order')
+        now = datetime.utcnow()
+        with patch.dict(app.config, MAIL_RETRY_BACKOFF=30, MAIL_MAX_ATTEMPTS=2), app.app_context():
+            drain_outbox(now)
+            message = OutboxMessage.query.one()
+            self.assertEqual((message.attempts, message.next_attempt_at), (1, now + timedelta(seconds=30)))
+            self.assertIn('Try again later', message.last_error)
+
+            drain_outbox(now + timedelta(seconds=29))
+            self.assertEqual(server.messages, [])
+            server.fail_next = 1
+            drain_outbox(now + timedelta(seconds=30))
+            message = OutboxMessage.query.one()
+            self.assertEqual((message.attempts, message.next_attempt_at), (2, None))
+
+    def test_outbox_message_that_fails_to_render_does_not_abort_batch(self):
+        server = self.smtp_server()
+        for username in ('ann', 'bob'):
+            user_id = self.login(username)
+            with app.app_context():
+                product = Product(name='Shirt for %s' % username, price=1.0)
+                db.session.add(product)
+                db.session.flush()
+                db.session.add(Cart(user_id=user_id, product_id=product.id, quantity=1))
+                db.session.commit()
+            self.app.post('/confirm_order')
+        with app.app_context():
+            # The first message now points at an order that no longer exists.
+            first = OutboxMessage.query.order_by(OutboxMessage.id).first()
+            first.payload = json.dumps({'order_id': 999})
+            db.session.commit()
+
+        with patch.dict(app.config, MAIL_MAX_ATTEMPTS=2), app.app_context(), \
+                self.assertLogs('views.outbox', 'ERROR'):
+            drain_outbox()
+            self.assertEqual([message['To'] for message in server.messages], ['bob@example.com'])
+            message = OutboxMessage.query.one()
+            self.assertEqual(message.attempts, 1)
+            self.assertIsNotNone(message.next_attempt_at)
+
+            drain_outbox(message.next_attempt_at)
+            message = OutboxMessage.query.one()
+            self.assertEqual((message.attempts, message.next_attempt_at), (2, None))
+        self.assertEqual(len(server.messages), 1)
+
+    def test_mailer_worker_drains_when_woken(self):
+        site = Flask(__name__)
+        worker = Mailer(site)
+        site.config['MAIL_POLL_INTERVAL'] = 60
+        drained = threading.Semaphore(0)
+        with site.app_context():
+            worker.start_worker(drained.release)
+            self.assertTrue(drained.acquire(timeout=5))
+            worker.start_worker(drained.release)
+            self.assertTrue(drained.acquire(timeout=5))
+
+    def test_orders_page_streams_in_batches(self):
+        user_id = self.login()
+        with app.app_context():
+            db.session.add_all([Order(user_id=user_id, total_price=i) for i in range(1, 6)])
+            db.session.commit()
+        with patch.dict(app.config, {'STREAM_BATCH_SIZE': 2}):
+            response = self.app.get('/orders', buffered=False)
+            self.assertTrue(response.is_streamed)
+            body = response.get_data(as_text=True)
+            response.close()
+        self.assertLess(body.index('Order #5'), body.index('Order #1'))
+
+    def test_foreign_keys_are_indexed(self):
+        # Every foreign key column must lead some index, or joins and
+        # per-parent lookups on it turn into full table scans.
+        for table in db.metadata.sorted_tables:
+            leading = {index.columns.values()[0].name for index in table.indexes}
+            leading.update(constraint.columns.values()[0].name for constraint in table.constraints
+                           if isinstance(constraint, (PrimaryKeyConstraint, UniqueConstraint)))
+            for fk in table.foreign_keys:
+                self.assertIn(fk.parent.name, leading, '%s.%s has no index' % (table.name, fk.parent.name))
+
+    def test_load_user_is_served_from_cache(self):
+        user_id = self.login()
+        self.app.get('/orders')
+        with self.count_queries() as statements:
+            response = self.app.get('/orders')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(statements), 1)
+        self.assertFalse(any('FROM user' in statement for statement in statements))
+
+        with app.app_context():
+            user = load_user(str(user_id))
+            self.assertEqual(user.username, 'shopper')
+            self.assertEqual(user.password, 'unused')
+
+    def test_updating_user_evicts_cache(self):
+        user_id = self.login()
+        with app.app_context():
+            load_user(str(user_id))
+            user = db.session.get(User, user_id)
+            user.username = 'renamed'
+            db.session.commit()
+        with app.app_context():
+            self.assertEqual(load_user(str(user_id)).username, 'renamed')
+
+    def test_user_cache_is_evicted_after_commit(self):
+        user_id = self.login()
+        with app.app_context():
+            user = db.session.get(User, user_id)
+            user.username = 'renamed'
+            db.session.flush()
+            # Another request loads the committed row between flush and commit.
+            user_cache.set(user_id, dict({key: getattr(user, key) for key in USER_CACHED_COLUMNS}, username='shopper'))
+            db.session.commit()
+        with app.app_context():
+            self.assertEqual(load_user(str(user_id)).username, 'renamed')
+
+    def test_ttl_cache_expires_and_evicts(self):
+        now = [0]
+        cache = TTLCache(maxsize=2, ttl=10, timer=lambda: now[0])
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+        now[0] = 11
+        self.assertIsNone(cache.get('c'))
+        self.assertEqual((cache.hits, cache.misses), (2, 2))
+
+    def test_register_and_login_hash_on_pool(self):
+        self.app.post('/register', data={'username': 'new', 'email': 'new@example.com', 'password': 'secret'})
+        with app.app_context():
+            self.assertTrue(User.query.filter_by(username='new').one().password.startswith('pbkdf2:sha256'))
+
+        response = self.app.post('/login', data={'email': 'new@example.com', 'password': 'wrong'})
+        self.assertEqual(response.status_code, 200)
+        response = self.app.post('/login', data={'email': 'new@example.com', 'password': 'secret'})
+        self.assertEqual(response.status_code, 302)
+
+    def test_password_hasher_applies_backpressure(self):
+        hasher = PasswordHasher()
+        hasher.configure(workers=1, queue_size=1, wait=0.01)
+        release = threading.Event()
+        running = [hasher.submit(release.wait), hasher.submit(release.wait)]
+        with self.assertRaises(HashingBusy):
+            hasher.submit(release.wait)
+        release.set()
+        for future in running:
+            future.result()
+        self.assertTrue(hasher.check(hasher.hash('pw'), 'pw'))
+        self.assertTrue(asyncio.run(hasher.check_async(hasher.hash('pw'), 'pw')))
+
+    def test_login_answers_503_when_hashing_pool_is_full(self):
+        with app.app_context():
+            db.session.add(User(username='u', email='u@example.com', password='pbkdf2:sha256:1$salt$hash'))
+            db.session.commit()
+        with patch.object(password_hasher, 'submit', side_effect=HashingBusy):
+            response = self.app.post('/login', data={'email': 'u@example.com', 'password': 'pw'})
+        self.assertEqual(response.status_code, 503)
+
+    def test_checkout_creates_payment_in_background(self):
+        server = FakePayPalServer().start()
+        self.addCleanup(server.stop)
+        gateway = PayPalGateway('sandbox', 'id', 'secret', endpoint=server.url, timeout=5)
+        self.fill_cart(self.login(), 2)
+
+        with patch.object(app.extensions['payments'], 'gateway', gateway):
+            response = self.app.post('/checkout')
+            self.assertEqual(response.status_code, 202)
+            app.extensions['payments'].queue.join(timeout=10)
+
+        status = self.app.get(response.json['status_url']).json
+        self.assertEqual(status['status'], 'created')
+        self.assertTrue(status['redirect_url'].startswith(server.url))
+        transaction = server.payments[0]['transactions'][0]
+        self.assertEqual(transaction['amount']['total'], '6.00')
+        self.assertEqual([item['name'] for item in transaction['item_list']['items']], ['Product 0', 'Product 1'])
+
+    def test_checkout_records_gateway_failure(self):
+        self.fill_cart(self.login(), 1)
+        failing = Mock(create_payment=Mock(side_effect=PaymentError('declined')))
+        with patch.object(app.extensions['payments'], 'gateway', failing):
+            response = self.app.post('/checkout')
+            app.extensions['payments'].queue.join(timeout=10)
+        status = self.app.get(response.json['status_url']).json
+        self.assertEqual((status['status'], status['error']), ('failed', 'declined'))
+
+    def test_payment_status_is_private(self):
+        self.fill_cart(self.login('owner'), 1)
+        with patch.object(app.extensions['payments'], 'gateway', Mock(create_payment=Mock(side_effect=PaymentError('x')))):
+            response = self.app.post('/checkout')
+            app.extensions['payments'].queue.join(timeout=10)
+        self.login('other')
+        self.assertEqual(self.app.get(response.json['status_url']).status_code, 404)
+
+    def test_sqlite_connections_use_profile(self):
+        with app.app_context():
+            busy_timeout = db.session.execute(text('PRAGMA busy_timeout')).scalar()
+        self.assertEqual(busy_timeout, app.config['SQLITE_PRAGMAS']['busy_timeout'])
+
+        with tempfile.TemporaryDirectory() as directory:
+            connection = sqlite3.connect(os.path.join(directory, 'profile.db'))
+            apply_sqlite_pragmas(connection, app.config['SQLITE_PRAGMAS'])
+            self.assertEqual(connection.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+            self.assertEqual(connection.execute('PRAGMA synchronous').fetchone()[0], 1)
+            connection.close()
+
+    def test_read_only_routes_read_from_replica(self):
+        with tempfile.TemporaryDirectory() as directory:
+            primary = create_engine('sqlite:///' + os.path.join(directory, 'primary.db'))
+            replica = create_engine('sqlite:///' + os.path.join(directory, 'replica.db'))
+            self.addCleanup(primary.dispose)
+            self.addCleanup(replica.dispose)
+            for engine in (primary, replica):
+                db.metadata.create_all(engine)
+            with replica.begin() as connection:
+                connection.execute(Product.__table__.insert(), {'name': 'Replica product', 'price': 1.0})
+
+            with app.app_context():
+                engines = db.engines
+            with patch.dict(engines, {None: primary, 'replica': replica}):
+                response = self.app.get('/products')
+                self.assertIn(b'Replica product', response.data)
+
+                response = self.app.post('/products', data={'name': 'Primary product', 'price': 2.0})
+                self.assertEqual(response.status_code, 302)
+
+            names = {}
+            for label, engine in (('primary', primary), ('replica', replica)):
+                with engine.connect() as connection:
+                    names[label] = connection.execute(text('SELECT name FROM product')).scalars().all()
+            self.assertEqual(names, {'primary': ['Primary product'], 'replica': ['Replica product']})
+
+    def test_responses_report_sql_server_timing(self):
+        self.add_products([1.0])
+        response = self.app.get('/products')
+        self.assertRegex(response.headers['Server-Timing'], r'^db;desc="queries: 2";dur=[0-9.]+, db-slow-1;dur=')
+
+    def test_second_app_does_not_count_statements_twice(self):
+        probe = ("import re; from application import create_app; from extensions import db\n"
+                 "apps = [create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://'}) for _ in range(2)]\n"
+                 "for one in apps:\n"
+                 "    with one.app_context(): db.create_all()\n"
+                 "    print(re.search('queries: [0-9]+', one.test_client().get('/products').headers['Server-Timing']).group())")
+        output = subprocess.run([sys.executable, '-c', probe], env=dict(os.environ, DATABASE_URL='sqlite://'),
+                                cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True,
+                                check=True).stdout
+        self.assertEqual(output.splitlines(), ['queries: 2', 'queries: 2'])
+
+    def test_apps_keep_their_own_extension_state(self):
+        probe = ("import os, sys, tempfile; from application import create_app; from extensions import db\n"
+                 "dirs = [tempfile.mkdtemp(), tempfile.mkdtemp()]\n"
+                 "apps = [create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://', 'METRICS_MULTIPROC_DIR': directory,\n"
+                 "                    'MAIL_SERVER': directory}) for directory in dirs]\n"
+                 "with apps[0].app_context(): db.create_all()\n"
+                 "apps[0].test_client().get('/products')\n"
+                 "print(len(os.listdir(dirs[0])), len(os.listdir(dirs[1])))\n"
+                 "print(*(one.extensions['mailer'].config['MAIL_SERVER'] == directory for one, directory in zip(apps, dirs)))\n"
+                 "print(apps[0].extensions['payments'].queue is not apps[1].extensions['payments'].queue)")
+        output = subprocess.run([sys.executable, '-c', probe], env=dict(os.environ, DATABASE_URL='sqlite://'),
+                                cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True,
+                                check=True).stdout
+        self.assertEqual(output.split(), ['1', '0', 'True', 'True', 'True'])
+
+    def test_failed_statements_leave_no_timing_behind(self):
+        with app.app_context():
+            with db.engine.connect() as connection:
+                with self.assertRaises(OperationalError):
+                    connection.execute(text('SELECT * FROM no_such_table'))
+                connection.rollback()
+                connection.execute(text('SELECT 1'))
+                self.assertEqual(connection.info['query_started'], [])
+
+    def test_slow_queries_are_logged(self):
+        with patch.dict(app.config, {'SQL_SLOW_QUERY_THRESHOLD': 0}):
+            with self.assertLogs('sql.slow', level='WARNING') as logs:
+                self.app.get('/products')
+        self.assertTrue(any('in catalog.products: SELECT product.id' in line for line in logs.output))
+
+    def test_query_budget_raises_in_tests(self):
+        with patch.dict(app.config, {'SQL_QUERY_BUDGET': 2}):
+            self.fill_cart(self.login(), 1)
+            with self.assertRaises(QueryBudgetExceeded):
+                self.app.get('/review_order')
+
+    def test_metrics_endpoint_reports_requests_pool_and_cache(self):
+        self.login()
+        self.app.get('/products')
+        self.app.get('/orders')
+        self.app.get('/orders')
+        body = self.app.get('/metrics').get_data(as_text=True)
+        self.assertRegex(body, r'http_requests_total\{endpoint="catalog.products",method="GET",status="200"\} [1-9]')
+        self.assertRegex(body, r'http_request_duration_seconds_count\{endpoint="orders.orders"\} [2-9]')
+        self.assertIn('# TYPE http_request_duration_seconds histogram', body)
+        self.assertRegex(body, r'http_requests_in_flight 1\n')
+        self.assertRegex(body, r'db_pool_checkouts_total\{engine="primary"\} [1-9]')
+        self.assertRegex(body, r'cache_hits_total\{cache="user"\} [1-9]')
+
+    def test_metrics_are_summed_across_processes(self):
+        exited_pid = subprocess.run([sys.executable, '-c', 'import os; print(os.getpid())'],
+                                    capture_output=True, text=True, check=True).stdout.strip()
+        with tempfile.TemporaryDirectory() as directory:
+            other = Registry()
+            other.counter('http_requests_total', 'HTTP requests handled.',
+                          ['endpoint', 'method', 'status']).inc(5, endpoint='catalog.products', method='GET', status=200)
+            other.gauge('http_requests_in_flight', 'HTTP requests currently being handled.').set(1000)
+            with open(os.path.join(directory, '%s.json' % exited_pid), 'w') as snapshot_file:
+                json.dump(other.snapshot(), snapshot_file)
+
+            with patch.dict(app.config, {'METRICS_MULTIPROC_DIR': directory}):
+                self.app.get('/products')
+                body = self.app.get('/metrics').get_data(as_text=True)
+                again = self.app.get('/metrics').get_data(as_text=True)
+            requests = r'http_requests_total\{endpoint="catalog.products",method="GET",status="200"\} (\d+)'
+            self.assertGreaterEqual(int(re.search(requests, body).group(1)), 6)
+            self.assertEqual(re.search(requests, again).group(1), re.search(requests, body).group(1))
+            self.assertNotRegex(body, r'http_requests_in_flight \d{4}')
+            self.assertTrue(os.path.exists(os.path.join(directory, '%d.json' % os.getpid())))
+            self.assertFalse(os.path.exists(os.path.join(directory, '%s.json' % exited_pid)))
+            self.assertTrue(os.path.exists(os.path.join(directory, 'exited.json')))
+
+    def test_anonymous_catalog_page_is_cached_until_products_change(self):
+        self.add_products([5.0])
+        self.assertIn(b'Product 0', self.app.get('/products').data)
+        with self.count_queries() as statements:
+            self.assertIn(b'Product 0', self.app.get('/products').data)
+        self.assertEqual(len(statements), 1)
+        self.assertIn('FROM catalog_version', statements[0])
+
+        with app.app_context():
+            db.session.get(Product, 1).name = 'Renamed'
+            db.session.commit()
+        self.assertIn(b'Renamed', self.app.get('/products').data)
+
+        with app.app_context():
+            db.session.delete(db.session.get(Product, 1))
+            db.session.commit()
+        self.assertNotIn(b'Renamed', self.app.get('/products').data)
+
+    def test_catalog_pages_answer_conditional_gets(self):
+        self.add_products([5.0])
+        response = self.app.get('/products')
+        etag = response.headers['ETag']
+        self.assertEqual(response.headers['Cache-Control'], 'no-cache')
+        self.assertIsNotNone(response.last_modified)
+
+        revalidated = self.app.get('/products', headers={'If-None-Match': etag})
+        self.assertEqual(revalidated.status_code, 304)
+        self.assertEqual(revalidated.data, b'')
+        since = self.app.get('/search?q=x', headers={'If-Modified-Since': response.headers['Last-Modified']})
+        self.assertEqual(since.status_code, 304)
+
+        weak = self.app.get('/products', headers={'If-None-Match': 'W/' + etag})
+        self.assertEqual(weak.status_code, 304)
+        with patch.object(app.extensions['assets'], 'build_id', 'redeployed'):
+            self.assertEqual(self.app.get('/products', headers={'If-None-Match': etag}).status_code, 200)
+
+        self.add_products([6.0])
+        changed = self.app.get('/products', headers={'If-None-Match': etag})
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed.headers['ETag'], etag)
+
+    def test_product_fragments_are_reused_for_signed_in_users(self):
+        self.add_products([5.0, 6.0])
+        self.login()
+        self.app.get('/products')
+        hits = catalog_cache.hits
+        self.assertIn(b'Product 1', self.app.get('/products').data)
+        self.assertEqual(catalog_cache.hits - hits, 2)
+
+    def test_sqlite_cache_is_shared_and_bounded(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'cache.db')
+            now = [1000.0]
+            cache = SQLiteCache(path, maxsize=2, ttl=10, timer=lambda: now[0])
+            cache.set_many({'a': '1', 'b': '2'})
+            self.assertEqual(SQLiteCache(path, timer=lambda: now[0]).get('a'), '1')
+            cache.set('c', '3')
+            self.assertEqual(len(cache), 2)
+            now[0] += 11
+            self.assertIsNone(cache.get('c'))
+
+    def test_assets_are_fingerprinted_and_served_precompressed(self):
+        with tempfile.TemporaryDirectory() as static_folder:
+            os.makedirs(os.path.join(static_folder, 'vendor'))
+            with open(os.path.join(static_folder, 'vendor', 'app.js'), 'w') as script:
+                script.write('console.log("cozzy");\n' * 50)
+            manifest = build(static_folder)
+            hashed = manifest['vendor/app.js']
+            self.assertRegex(hashed, r'^dist/vendor/app\.[0-9a-f]{12}\.js$')
+            self.assertTrue(os.path.exists(os.path.join(static_folder, hashed + '.gz')))
+
+            site = Flask('site', static_folder=static_folder, static_url_path='/static')
+            Assets(site)
+            with site.test_request_context():
+                self.assertEqual(url_for('static', filename='vendor/app.js'), '/static/' + hashed)
+            client = site.test_client()
+            response = client.get('/static/' + hashed, headers={'Accept-Encoding': 'gzip'})
+            self.assertEqual(response.content_encoding, 'gzip')
+            self.assertIn('immutable', response.headers['Cache-Control'])
+            self.assertIn('javascript', response.mimetype)
+            response.close()
+            plain = client.get('/static/' + hashed)
+            self.assertIsNone(plain.content_encoding)
+            self.assertIn(b'cozzy', plain.data)
+            plain.close()
+
+    def test_pages_load_jquery_3_6_4(self):
+        body = self.app.get('/products').data
+        self.assertIn(b'jquery-3.6.4.min.js', body)
+        self.assertNotIn(b'jquery-3.6.1', body)
+
+    def test_templates_are_precompiled_into_bytecode_cache(self):
+        self.assertIsInstance(app.jinja_env.bytecode_cache, FileSystemBytecodeCache)
+        with tempfile.TemporaryDirectory() as directory:
+            with patch.object(app.jinja_env, 'bytecode_cache', FileSystemBytecodeCache(directory)):
+                app.jinja_env.cache.clear()
+                precompile_templates(app)
+                self.assertEqual(len(os.listdir(directory)), len(app.jinja_env.list_templates()))
+        self.assertEqual(len(app.jinja_env.cache), len(app.jinja_env.list_templates()))
+
+    def test_wsgi_app_does_not_import_payment_sdk_or_alembic(self):
+        probe = "import sys, wsgi; print('paypalrestsdk' in sys.modules, 'alembic' in sys.modules)"
+        output = subprocess.run([sys.executable, '-c', probe], env=dict(os.environ, DATABASE_URL='sqlite://'),
+                                cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True,
+                                check=True).stdout
+        self.assertEqual(output.split(), ['False', 'False'])
+
+    def test_engine_options_follow_database_url_passed_to_create_app(self):
+        self.assertTrue(engine_options('postgresql://shop@db/shop', app.config)['pool_pre_ping'])
+        self.assertEqual(engine_options('sqlite://', app.config), {})
+        self.assertEqual(engine_options('sqlite:///:memory:', app.config), {})
+        self.assertEqual(engine_options('sqlite:///site.db', app.config)['pool_size'], app.config['SQLITE_POOL_SIZE'])
+        # The environment names a SQLite file, the override an in-memory
+        # database, which must not get the file's pool settings.
+        probe = ("from application import create_app; from extensions import db; "
+                 "app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://', 'DATABASE_REPLICA_URL': 'sqlite://'}); "
+                 "print(app.config['SQLALCHEMY_ENGINE_OPTIONS'], sorted(app.config['SQLALCHEMY_BINDS']))")
+        with tempfile.TemporaryDirectory() as directory:
+            output = subprocess.run(
+                [sys.executable, '-c', probe], capture_output=True, text=True, check=True,
+                env=dict(os.environ, DATABASE_URL='sqlite:///' + os.path.join(directory, 'site.db')),
+                cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+        self.assertEqual(output.split(), ['{}', "['replica']"])
+
+    def test_forked_children_drop_engines_of_every_app_from_one_hook(self):
+        with app.app_context():
+            engine = db.engine
+        self.assertIn(engine, _forked_engines)
+        with patch.object(type(engine), 'dispose') as dispose:
+            _dispose_forked_engines()
+        dispose.assert_called_with(close=False)
+
+
 if __name__ == '__main__':
     unittest.main()
     
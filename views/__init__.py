@@ -0,0 +1 @@
+"""Blueprints, one module per area of the shop."""
@@ -0,0 +1,105 @@
+from flask import Blueprint, current_app, flash, redirect, render_template, url_for
+from flask_login import current_user, login_required, login_user, logout_user
+from sqlalchemy import event
+from sqlalchemy.orm import make_transient_to_detached, object_session
+
+from extensions import RoutingSession, db, login_manager, password_hasher
+from forms import LoginForm, RegistrationForm
+from hashing import HashingBusy
+from models import User
+from views.cart import merge_session_cart
+
+bp = Blueprint('auth', __name__)
+
+@bp.route('/register', methods=['GET', 'POST'])
+def register():
+    if current_user.is_authenticated:
+        return redirect(url_for('catalog.home'))
+
+    form = RegistrationForm()
+    if form.validate_on_submit():
+        try:
+            hashed_password = password_hasher.hash(form.password.data)
+        except HashingBusy:
+            flash('We are handling a lot of sign-ups right now. Please try again in a moment.', 'warning')
+            return render_template('register.html', form=form), 503
+        new_user = User(username=form.username.data, email=form.email.data, password=hashed_password)
+        db.session.add(new_user)
+        db.session.commit()
+        flash('Your account has been created! You can now log in.', 'success')
+        return redirect(url_for('auth.login'))
+
+    return render_template('register.html', form=form)
+
+@bp.route('/login', methods=['GET', 'POST'])
+def login():
+    if current_user.is_authenticated:
+        return redirect(url_for('catalog.home'))
+
+    form = LoginForm()
+    if form.validate_on_submit():
+        print("Form vlaidated successfully!")
+        user = User.query.filter_by(email=form.email.data).first()
+        try:
+            valid = user is not None and password_hasher.check(user.password, form.password.data)
+        except HashingBusy:
+            flash('We are handling a lot of logins right now. Please try again in a moment.', 'warning')
+            return render_template('login.html', form=form), 503
+        if valid:
+            login_user(user, remember=False)
+            if merge_session_cart(user.id):
+                db.session.commit()
+            flash('Login successful!', 'success')
+            return redirect(url_for('catalog.home'))
+        else:
+            flash('Login unsuccessful. Please check email and password', 'danger')
+    else:
+        print(form.errors)
+
+    return render_template('login.html', form=form)
+
+@bp.route('/logout')
+@login_required
+def logout():
+    logout_user()
+    flash('You have been logged out.', 'info')
+    return redirect(url_for('catalog.home'))
+
+# Users are cached per process as plain column values (minus the password
+# hash) and re-attached to each request's session without a query. Writes
+# through the ORM evict the entry once they commit: evicting at flush time
+# would let a concurrent load_user cache the old row again before the commit.
+# Other processes see changes within USER_CACHE_TTL seconds.
+USER_CACHED_COLUMNS = [column.key for column in User.__table__.columns if column.key != 'password']
+
+def user_cache():
+    return current_app.extensions['user_cache']
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def mark_cached_user_stale(mapper, connection, user):
+    object_session(user).info.setdefault('stale_user_ids', set()).add(user.id)
+
+@event.listens_for(RoutingSession, 'after_commit')
+def evict_cached_users(session):
+    for user_id in session.info.pop('stale_user_ids', ()):
+        user_cache().pop(user_id)
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def forget_stale_users(session):
+    session.info.pop('stale_user_ids', None)
+
+@login_manager.user_loader
+def load_user(user_id):
+    user_id = int(user_id)
+    cache = user_cache()
+    values = cache.get(user_id)
+    if values is None:
+        user = db.session.get(User, user_id)
+        if user is not None:
+            cache.set(user_id, {key: getattr(user, key) for key in USER_CACHED_COLUMNS})
+        return user
+
+    user = User(**values)
+    make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
@@ -0,0 +1,297 @@
+import time
+from datetime import datetime, timedelta
+
+import click
+from flask import (Blueprint, abort, current_app, flash, jsonify, redirect, render_template, request, session,
+                   url_for)
+from flask_login import current_user, login_required
+from sqlalchemy import case, delete, exists, func, literal, select
+from sqlalchemy.orm import aliased, joinedload
+
+from extensions import db, metrics
+from forms import OrderForm
+from models import Cart, OrderItem, Product, is_valid_id, upsert
+
+bp = Blueprint('cart', __name__)
+
+cart_lines_gauge = metrics.registry.gauge('cart_lines', 'Rows in the cart table after the last sweep.')
+cart_lines_swept = metrics.registry.counter('cart_lines_swept_total', 'Expired cart rows deleted by the sweeper.')
+cart_last_sweep = metrics.registry.gauge(
+    'cart_sweep_last_run_timestamp_seconds', 'Unix time the cart sweeper last finished.')
+
+def add_cart_item(user_id, product_id, quantity=1):
+    """Add ``quantity`` of a product to a user's cart in one statement.
+
+    The row is inserted from a SELECT on product, so a missing product inserts
+    nothing, and an existing line is incremented in place by the conflict on
+    (user_id, product_id). Returns False when the product does not exist.
+    """
+    statement = upsert(Cart).from_select(
+        ['user_id', 'product_id', 'quantity'],
+        select(literal(user_id, db.Integer), Product.id, literal(quantity, db.Integer))
+        .where(Product.id == product_id))
+    statement = statement.on_conflict_do_update(
+        index_elements=['user_id', 'product_id'],
+        set_={'quantity': Cart.quantity + statement.excluded.quantity,
+              'updated_at': statement.excluded.updated_at})
+    return db.session.execute(statement).rowcount > 0
+
+# Shoppers who are not logged in keep their cart in the signed session cookie
+# as {product id: quantity}, so browsing and adding to the cart never write to
+# the database. The cart is merged into the cart table when they log in.
+def add_session_cart_item(product_id, quantity=1):
+    """Add to the session cart, up to CART_API_MAX_AMOUNT units of a product.
+
+    Returns False when the cart has no room left.
+    """
+    cart = dict(session.get('cart', {}))
+    key = str(product_id)
+    if key not in cart and len(cart) >= current_app.config['SESSION_CART_MAX_LINES']:
+        return False
+    cart[key] = min(cart.get(key, 0) + quantity, current_app.config['CART_API_MAX_AMOUNT'])
+    session['cart'] = cart
+    return True
+
+def merge_session_cart(user_id):
+    """Move the session cart into a user's cart with one upsert.
+
+    Lines are inserted from a SELECT on product, so products deleted since
+    they were added are dropped, and quantities are added to lines the user
+    already has. Entries no request could have written (the cookie predates
+    the quantity cap, say) are dropped or capped, so they cannot fail the
+    login. Returns the number of lines merged. The caller commits.
+    """
+    cart = session.pop('cart', None)
+    if not cart:
+        return 0
+    quantities = {int(product_id): min(quantity, current_app.config['CART_API_MAX_AMOUNT'])
+                  for product_id, quantity in cart.items()
+                  if product_id.isdigit() and is_valid_id(int(product_id)) and type(quantity) is int and quantity > 0}
+    if not quantities:
+        return 0
+    statement = upsert(Cart).from_select(
+        ['user_id', 'product_id', 'quantity'],
+        select(literal(user_id, db.Integer), Product.id, case(quantities, value=Product.id))
+        .where(Product.id.in_(quantities)))
+    statement = statement.on_conflict_do_update(
+        index_elements=['user_id', 'product_id'],
+        set_={'quantity': Cart.quantity + statement.excluded.quantity,
+              'updated_at': statement.excluded.updated_at})
+    return db.session.execute(statement).rowcount
+
+def cart_lines(user_id):
+    """Return a user's cart lines with their products loaded in the same query."""
+    return Cart.query.options(joinedload(Cart.product)).filter_by(user_id=user_id).order_by(Cart.id).all()
+
+def cart_total(user_id):
+    """Price a user's cart with one aggregate over cart JOIN product."""
+    return db.session.query(func.coalesce(func.sum(Product.price * Cart.quantity), 0)) \
+        .select_from(Cart).join(Cart.product).filter(Cart.user_id == user_id).scalar()
+
+# Batch cart edits
+def fold_cart_operations(operations):
+    """Validate a list of cart operations and fold them per product.
+
+    Each operation is {"product_id": id, "delta": n} to add n (or remove, if
+    negative) or {"product_id": id, "quantity": n} to set the quantity, 0
+    removing the line. Returns {product_id: (is_delta, n)}, applying later
+    operations on the same product on top of earlier ones. Raises ValueError
+    for a malformed list, and for ids and amounts the database cannot hold,
+    so they never reach a statement.
+    """
+    config = current_app.config
+    if not isinstance(operations, list) or not operations:
+        raise ValueError('Expected a non-empty list of operations.')
+    if len(operations) > config['CART_API_MAX_OPERATIONS']:
+        raise ValueError('At most %d operations are allowed.' % config['CART_API_MAX_OPERATIONS'])
+    changes = {}
+    for operation in operations:
+        if not isinstance(operation, dict) or len(operation) != 2 or type(operation.get('product_id')) is not int:
+            raise ValueError('Each operation needs a product_id and one of delta or quantity.')
+        if not is_valid_id(operation['product_id']):
+            raise ValueError('Unknown product_id %d.' % operation['product_id'])
+        amount = operation.get('delta', operation.get('quantity'))
+        if type(amount) is int and abs(amount) > config['CART_API_MAX_AMOUNT']:
+            raise ValueError('A delta or quantity may be at most %d.' % config['CART_API_MAX_AMOUNT'])
+        if type(operation.get('delta')) is int:
+            is_delta, amount = changes.get(operation['product_id'], (True, 0))
+            changes[operation['product_id']] = (is_delta, amount + operation['delta'])
+        elif type(operation.get('quantity')) is int and operation['quantity'] >= 0:
+            changes[operation['product_id']] = (False, operation['quantity'])
+        else:
+            raise ValueError('Each operation needs a product_id and one of delta or quantity.')
+    return changes
+
+def apply_cart_changes(user_id, changes):
+    """Apply folded operations to a user's cart with one upsert and one DELETE.
+
+    The upsert inserts from a SELECT on product, so unknown products are
+    skipped, and its conflict clause adds deltas to existing lines or
+    replaces their quantity. Lines left at zero or below are then deleted.
+    The caller commits.
+    """
+    amounts = {product_id: amount for product_id, (is_delta, amount) in changes.items()}
+    deltas = [product_id for product_id, (is_delta, amount) in changes.items() if is_delta]
+    statement = upsert(Cart).from_select(
+        ['user_id', 'product_id', 'quantity'],
+        select(literal(user_id, db.Integer), Product.id, case(amounts, value=Product.id))
+        .where(Product.id.in_(amounts)))
+    statement = statement.on_conflict_do_update(
+        index_elements=['user_id', 'product_id'],
+        set_={'quantity': case((Cart.product_id.in_(deltas), Cart.quantity + statement.excluded.quantity),
+                               else_=statement.excluded.quantity),
+              'updated_at': statement.excluded.updated_at})
+    db.session.execute(statement)
+    db.session.execute(delete(Cart).where(Cart.user_id == user_id, Cart.product_id.in_(amounts),
+                                          Cart.quantity <= 0))
+
+def apply_session_cart_changes(changes):
+    """Apply folded operations to the session cart and return its products.
+
+    Returns None, leaving the session untouched, when the result would not
+    fit in SESSION_CART_MAX_LINES.
+    """
+    cart = dict(session.get('cart', {}))
+    for product_id, (is_delta, amount) in changes.items():
+        quantity = cart.get(str(product_id), 0) + amount if is_delta else amount
+        if quantity > 0:
+            cart[str(product_id)] = min(quantity, current_app.config['CART_API_MAX_AMOUNT'])
+        else:
+            cart.pop(str(product_id), None)
+    products = Product.query.filter(Product.id.in_([int(product_id) for product_id in cart])).all() if cart else []
+    if len(products) > current_app.config['SESSION_CART_MAX_LINES']:
+        return None
+    session['cart'] = {str(product.id): cart[str(product.id)] for product in products}
+    return products
+
+def cart_summary(lines):
+    """Describe (product, quantity) pairs as the JSON the cart API returns."""
+    items = [{
+        'product_id': product.id,
+        'name': product.name,
+        'price': product.price,
+        'quantity': quantity,
+        'subtotal': round(product.price * quantity, 2),
+    } for product, quantity in lines]
+    return {
+        'items': items,
+        'quantity': sum(item['quantity'] for item in items),
+        'total': round(sum(item['subtotal'] for item in items), 2),
+    }
+
+@bp.route('/api/cart', methods=['PATCH'])
+def patch_cart():
+    try:
+        changes = fold_cart_operations(request.get_json(silent=True))
+    except ValueError as error:
+        return jsonify({'error': str(error)}), 400
+
+    if not current_user.is_authenticated:
+        products = apply_session_cart_changes(changes)
+        if products is None:
+            return jsonify({'error': 'Your cart is full. Log in to add more products.'}), 409
+        quantities = session['cart']
+        return jsonify(cart_summary((product, quantities[str(product.id)])
+                                    for product in sorted(products, key=lambda product: product.id)))
+
+    apply_cart_changes(current_user.id, changes)
+    db.session.commit()
+    return jsonify(cart_summary((line.product, line.quantity) for line in cart_lines(current_user.id)))
+
+# Expired carts
+def sweep_expired_carts(now=None, batch_size=500):
+    """Delete carts left untouched for CART_TTL, ``batch_size`` rows at a time.
+
+    A cart expires as a whole, once its most recently updated line is older
+    than the TTL. Each batch is its own short transaction, so on SQLite
+    shoppers' writes get the lock between batches instead of waiting for the
+    whole sweep. Returns the number of rows deleted.
+    """
+    cutoff = (now or datetime.utcnow()) - timedelta(seconds=current_app.config['CART_TTL'])
+    recent = aliased(Cart)
+    expired = select(Cart.id).where(
+        Cart.updated_at < cutoff,
+        ~exists().where(recent.user_id == Cart.user_id, recent.updated_at >= cutoff),
+    ).order_by(Cart.id).limit(batch_size).correlate(None)
+    swept = 0
+    while True:
+        deleted = db.session.execute(delete(Cart).where(Cart.id.in_(expired))
+                                     .execution_options(synchronize_session=False)).rowcount
+        db.session.commit()
+        swept += deleted
+        cart_lines_swept.inc(deleted)
+        if deleted < batch_size:
+            break
+    cart_lines_gauge.set(db.session.scalar(select(func.count()).select_from(Cart)))
+    cart_last_sweep.set(time.time())
+    return swept
+
+@bp.cli.command('sweep')
+@click.option('--interval', type=float, default=None,
+              help='Keep running, sweeping every INTERVAL seconds, instead of sweeping once.')
+def sweep_command(interval):
+    """Delete expired carts; run it from cron, or with --interval."""
+    while True:
+        swept = sweep_expired_carts(batch_size=current_app.config['CART_SWEEP_BATCH_SIZE'])
+        metrics.flush('cart-sweeper')
+        click.echo('Swept %d expired cart lines' % swept)
+        if interval is None:
+            return
+        time.sleep(interval)
+
+@bp.route('/cart', methods=['GET', 'POST'])
+def cart():
+    if request.method == 'POST':
+        form = OrderForm()
+        if form.validate_on_submit():
+            product_id = form.product_id.data
+            quantity =form.quantity.data
+
+            product = Product.query.get(product_id)
+            if product:
+                order_item = OrderItem(product=product, quantity=quantity)
+                db.session.add(order_item)
+                db.session.commit()
+                return redirect(url_for('cart.cart'))
+
+    elif request.method == 'GET':
+        form = OrderForm()
+        cart_items = OrderItem.query.all()
+        return render_template('cart.html', cart_items, form=form)
+
+
+@bp.route('/add_to_cart/<int:product_id>', methods=['POST'])
+def add_to_cart(product_id):
+    quantity = request.form.get('quantity', 1, type=int)
+    if not 1 <= quantity <= current_app.config['CART_API_MAX_AMOUNT']:
+        abort(400)
+    if not is_valid_id(product_id):
+        abort(404)
+    if not current_user.is_authenticated:
+        if db.session.scalar(select(Product.id).where(Product.id == product_id)) is None:
+            abort(404)
+        if not add_session_cart_item(product_id, quantity):
+            flash('Your cart is full. Log in to add more products.', 'warning')
+            return redirect(url_for('catalog.products'))
+    elif add_cart_item(current_user.id, product_id, quantity):
+        db.session.commit()
+    else:
+        abort(404)
+
+    flash('Product added to cart successfully!', 'success')
+    return redirect(url_for('catalog.products'))
+
+@bp.route('/remove_from_cart/<int:cart_id>', methods=['POST'])
+@login_required
+def remove_from_cart(cart_id):
+    cart_item.quantity = Cart.query.get_or404(cart_id)
+
+
+    if cart_item.quantity > 1:
+        cart_item.quantity -= 1
+    else:
+        db.session.delete(cart_item)
+
+    db.session.commit()
+    flash('Product removed from cart successfully!', 'success')
+    return redirect (url_for('view_cart'))
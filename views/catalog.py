@@ -0,0 +1,287 @@
+import math
+import re
+from collections import namedtuple
+from datetime import timezone
+from functools import wraps
+
+from flask import (Blueprint, abort, current_app, flash, g, make_response, redirect, render_template, request,
+                   stream_template, url_for)
+from flask_login import current_user, login_required
+from markupsafe import Markup
+from sqlalchemy import and_, or_, select, text
+
+from extensions import db, read_only
+from forms import ProductForm
+from models import CatalogVersion, Product, is_valid_id
+
+bp = Blueprint('catalog', __name__)
+
+def catalog_cache():
+    """Return the app's cache of rendered product fragments and pages.
+
+    Product fragments are keyed by id and updated_at, so an edited product
+    simply misses. Whole pages for anonymous visitors are keyed by the
+    catalog version, so every cached page is orphaned by a write.
+    """
+    return current_app.extensions['catalog_cache']
+
+def catalog_version():
+    """Return (version, updated_at) of the catalog, read once per request."""
+    if 'catalog_version' not in g:
+        row = db.session.execute(select(CatalogVersion.version, CatalogVersion.updated_at)
+                                 .where(CatalogVersion.id == 1)).one()
+        g.catalog_version = (row.version, row.updated_at.replace(microsecond=0, tzinfo=timezone.utc))
+    return g.catalog_version
+
+def conditional_on_catalog(view):
+    """Answer GET and HEAD with 304 Not Modified while the catalog is unchanged.
+
+    The ETag and Last-Modified come from CatalogVersion, so revalidating
+    costs one primary-key read and the view does not run at all. The ETag
+    also names the assets build, so a deploy that changes the page's
+    stylesheet or scripts is not answered from a stale copy. It is compared
+    weakly, since a compressing proxy may have weakened it.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return view(*args, **kwargs)
+        version, modified = catalog_version()
+        etag = 'catalog-%d-%s' % (version, current_app.extensions['assets'].build_id)
+        if request.if_none_match:
+            not_modified = request.if_none_match.contains_weak(etag)
+        else:
+            not_modified = request.if_modified_since is not None and request.if_modified_since >= modified
+        response = current_app.response_class(status=304) if not_modified else make_response(view(*args, **kwargs))
+        if response.status_code in (200, 304):
+            response.set_etag(etag)
+            response.last_modified = modified
+            response.cache_control.no_cache = True
+        return response
+    return wrapper
+
+# Catalog pagination
+# Pages are addressed by keyset cursors instead of OFFSET, so fetching page
+# 10,000 costs the same index range scan as fetching page 1.
+PRODUCT_SORT_KEYS = {
+    'id': (Product.id,),
+    'price': (Product.price, Product.id),
+}
+
+ProductPage = namedtuple('ProductPage', ['items', 'next_cursor', 'prev_cursor'])
+
+def encode_cursor(product, sort='id'):
+    return ':'.join(repr(getattr(product, column.key)) for column in PRODUCT_SORT_KEYS[sort])
+
+def decode_cursor(cursor, sort='id'):
+    columns = PRODUCT_SORT_KEYS[sort]
+    parts = cursor.split(':')
+    if len(parts) != len(columns):
+        raise ValueError('Malformed cursor: %r' % cursor)
+    values = tuple(int(part) if column.key == 'id' else float(part) for column, part in zip(columns, parts))
+    if not is_valid_id(values[-1]) or not all(map(math.isfinite, values)):
+        raise ValueError('Cursor out of range: %r' % cursor)
+    return values
+
+def keyset_filter(sort, values, forward=True):
+    if sort == 'price':
+        price, product_id = values
+        if forward:
+            return and_(Product.price >= price, or_(Product.price > price, Product.id > product_id))
+        return and_(Product.price <= price, or_(Product.price < price, Product.id < product_id))
+    return Product.id > values[0] if forward else Product.id < values[0]
+
+def paginate_products(sort='id', after=None, before=None, per_page=20):
+    """Return one page of products ordered by ``sort`` ('id' or 'price').
+
+    ``after`` and ``before`` are cursors taken from a neighbouring page; at most
+    one of them should be given. One extra row is fetched to find out whether
+    another page exists, so no COUNT(*) over the catalog is ever needed.
+    """
+    columns = PRODUCT_SORT_KEYS[sort]
+    forward = before is None
+    cursor = after if forward else before
+
+    query = Product.query
+    if cursor is not None:
+        query = query.filter(keyset_filter(sort, decode_cursor(cursor, sort), forward))
+    query = query.order_by(*[column.asc() if forward else column.desc() for column in columns])
+
+    items = query.limit(per_page + 1).all()
+    has_more = len(items) > per_page
+    items = items[:per_page]
+    if not forward:
+        items.reverse()
+    if not items:
+        return ProductPage(items, None, None)
+
+    next_cursor = encode_cursor(items[-1], sort) if (has_more if forward else True) else None
+    prev_cursor = encode_cursor(items[0], sort) if (cursor is not None if forward else has_more) else None
+    return ProductPage(items, next_cursor, prev_cursor)
+
+def render_product_fragments(products):
+    """Return the rendered HTML of each product, from the cache where possible."""
+    cache = catalog_cache()
+    keys = ['product:%d:%s' % (product.id, product.updated_at.isoformat()) for product in products]
+    cached = cache.get_many(keys)
+    rendered = {}
+    fragments = []
+    for key, product in zip(keys, products):
+        fragment = cached.get(key)
+        if fragment is None:
+            fragment = rendered[key] = render_template('product_fragment.html', product=product)
+        fragments.append(Markup(fragment))
+    if rendered:
+        cache.set_many(rendered)
+    return fragments
+
+def cache_when_complete(cache, key, chunks):
+    """Pass ``chunks`` through, caching their concatenation if all are sent."""
+    body = []
+    for chunk in chunks:
+        body.append(chunk)
+        yield chunk
+    cache.set(key, ''.join(body))
+
+# Search
+def fts_query(terms):
+    """Turn free text into an FTS5 MATCH expression of quoted prefix terms."""
+    return ' '.join('"%s"*' % word for word in re.findall(r'\w+', terms))
+
+def search_products(terms, limit=20):
+    """Return up to ``limit`` products matching ``terms``, best match first.
+
+    Ranking is BM25 with name matches weighted above description matches.
+    """
+    match = fts_query(terms)
+    if not match:
+        return []
+
+    if db.engine.dialect.name != 'sqlite':
+        pattern = '%%%s%%' % terms
+        return Product.query.filter(or_(Product.name.ilike(pattern), Product.description.ilike(pattern))) \
+            .order_by(Product.id).limit(limit).all()
+
+    ranked = text(
+        'SELECT rowid AS id, bm25(product_fts, 10.0, 1.0) AS rank FROM product_fts '
+        'WHERE product_fts MATCH :match ORDER BY rank LIMIT :limit'
+    ).bindparams(match=match, limit=limit).columns(id=db.Integer, rank=db.Float).subquery('ranked')
+    return Product.query.join(ranked, ranked.c.id == Product.id).order_by(ranked.c.rank).all()
+
+# Routes
+@bp.route('/')
+def home():
+    return render_template('index.html')
+
+@bp.route('/admin')
+@login_required
+def admin():
+    if not current_user.is_admin:
+        flash('Access denied. You must be an admin to view this page.')
+        return redirect(url_for('catalog.index'))
+    return render_template('admin.html')
+
+@bp.route('/')
+@bp.route('/index')
+def index():
+    if current_user.is_authenticated:
+        if current_user.is_admin:
+            return render_template('admin.html')
+        else:
+            return render_template('user.html')
+    return render_template('index.html')
+
+@bp.route('/products', methods=['GET', 'POST'])
+@read_only
+@conditional_on_catalog
+def products():
+    form = ProductForm()
+    if form.validate_on_submit():
+        new_product = Product(
+            name = form.name.data,
+            description = form.description.data,
+            price = form.price.data,
+            stock = form.stock.data
+        )
+        db.session.add(new_product)
+        db.session.commit()
+        return redirect(url_for('catalog.products'))
+
+    # Anonymous visitors all see the same page, so it is cached whole.
+    page_key = None
+    if not current_user.is_authenticated:
+        page_key = 'page:%d:%s' % (catalog_version()[0], request.full_path)
+        cached_page = catalog_cache().get(page_key)
+        if cached_page is not None:
+            return cached_page
+
+    sort = request.args.get('sort', 'id')
+    if sort not in PRODUCT_SORT_KEYS:
+        abort(400)
+    per_page = request.args.get('per_page', current_app.config['PRODUCTS_PER_PAGE'], type=int)
+    per_page = max(1, min(per_page, current_app.config['PRODUCTS_MAX_PER_PAGE']))
+    try:
+        page = paginate_products(sort, after=request.args.get('after'),
+                                 before=request.args.get('before'), per_page=per_page)
+    except ValueError:
+        abort(400)
+
+    # The page is sent as it renders; a cacheable page is stored once complete.
+    chunks = stream_template('products.html', products=page.items, fragments=render_product_fragments(page.items),
+                             page=page, sort=sort, per_page=per_page, form=form)
+    if page_key is not None:
+        chunks = cache_when_complete(catalog_cache(), page_key, chunks)
+    return current_app.response_class(chunks)
+
+@bp.route('/search')
+@read_only
+@conditional_on_catalog
+def search():
+    query = request.args.get('q', '')
+    limit = max(1, min(request.args.get('limit', current_app.config['PRODUCTS_PER_PAGE'], type=int),
+                       current_app.config['PRODUCTS_MAX_PER_PAGE']))
+    results = search_products(query, limit=limit)
+    return render_template('products.html', products=results, fragments=render_product_fragments(results),
+                           query=query, form=ProductForm())
+
+@bp.route('/add_product', methods=['GET', 'POST'])
+def add_product():
+    form = ProductForm()
+
+    if form.validate_on_submit():
+        new_product = Product(
+            name = form.name.data,
+            description = form.description.data,
+            price = form.price.data,
+            stock = form.stock.data
+        )
+
+        db.session.add(new_product)
+        db.session.commit()
+
+        flash('Product added succesfully!', 'success')
+        return redirect(url_for('catalog.home'))
+
+    return render_template('add_product.html', form=form)
+
+@bp.route('/product/new', methods=['GET', 'POST'])
+@login_required
+def new_product():
+    form = ProductForm()
+    if form.validate_on_submit():
+        new_product = Product(name=form.name.data, description=form.description.data, price=form.price.data,
+                              stock=form.stock.data)
+        db.session.add(new_product)
+        db.session.commit()
+        flash('Producct has been added successfully!', 'success')
+        return redirect(url_for('catalog.products'))
+
+    return render_template('new_product.html', form=form)
+
+@bp.route('/product/delete/<int:product_id>', methods=['POST'])
+def delete_product(product_id):
+    product = Product.query.get_or_404(product_id)
+    db.session.delete(product)
+    db.session.commit()
+    flash('Product has been deleted successfully!', 'success')
+    return redirect(url_for('catalog.products'))
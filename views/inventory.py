@@ -0,0 +1,102 @@
+from datetime import datetime, timedelta
+
+import click
+from flask import Blueprint, current_app
+from sqlalchemy import delete, func, insert, literal, select, update
+
+from extensions import db
+from models import Cart, Product, StockReservation
+
+bp = Blueprint('inventory', __name__)
+
+class OutOfStock(Exception):
+    """Raised when a cart asks for more units than a product has left."""
+
+    def __init__(self, product_ids):
+        super(OutOfStock, self).__init__('Out of stock: %s' % ', '.join(map(str, product_ids)))
+        self.product_ids = product_ids
+
+def take_stock(user_id):
+    """Decrement stock for every tracked product in a user's cart.
+
+    Each product is decremented by a conditional UPDATE (stock = stock - n
+    WHERE stock >= n), all of them in one statement, so concurrent checkouts
+    of the same product only wait on that product's row and can never take
+    it below zero. If any line is short the transaction is rolled back and
+    OutOfStock names the short products. Products with a NULL stock are not
+    tracked and always succeed.
+    """
+    quantity = select(Cart.quantity).where(Cart.user_id == user_id, Cart.product_id == Product.id).scalar_subquery()
+    tracked = db.session.scalars(select(Cart.product_id).join(Cart.product)
+                                 .where(Cart.user_id == user_id, Product.stock.isnot(None))).all()
+    if not tracked:
+        return
+    # updated_at is set to itself: stock is not shown in the catalog, so a
+    # sale should not invalidate the product's cached fragment.
+    taken = db.session.scalars(
+        update(Product)
+        .where(Product.id.in_(tracked), Product.stock >= quantity)
+        .values(stock=Product.stock - quantity, updated_at=Product.updated_at)
+        .returning(Product.id)
+        .execution_options(synchronize_session=False)).all()
+    if len(taken) < len(tracked):
+        db.session.rollback()
+        raise OutOfStock(sorted(set(tracked) - set(taken)))
+
+def release_reservations(*criteria):
+    """Return the units of the reservations matching ``criteria`` to stock.
+
+    One UPDATE adds each product's reserved units back and one DELETE drops
+    the reservations. Returns the number of reservations released. The
+    caller commits.
+    """
+    reserved = select(func.sum(StockReservation.quantity)) \
+        .where(StockReservation.product_id == Product.id, *criteria).scalar_subquery()
+    db.session.execute(
+        update(Product)
+        .where(Product.id.in_(select(StockReservation.product_id).where(*criteria)))
+        .values(stock=Product.stock + reserved, updated_at=Product.updated_at)
+        .execution_options(synchronize_session=False))
+    return db.session.execute(
+        delete(StockReservation).where(*criteria).execution_options(synchronize_session=False)).rowcount
+
+def reserve_stock(user_id, ttl):
+    """Hold the stock for a user's cart for ``ttl`` seconds.
+
+    Any earlier reservations of the user are released first, in the same
+    transaction, so reserving again after changing the cart only holds the
+    new quantities. Raises OutOfStock (after rolling back) when a line is
+    short. The caller commits.
+    """
+    release_reservations(StockReservation.user_id == user_id)
+    take_stock(user_id)
+    expires_at = datetime.utcnow() + timedelta(seconds=ttl)
+    db.session.execute(insert(StockReservation).from_select(
+        ['user_id', 'product_id', 'quantity', 'expires_at'],
+        select(literal(user_id, db.Integer), Cart.product_id, Cart.quantity, literal(expires_at, db.DateTime))
+        .join(Cart.product).where(Cart.user_id == user_id, Product.stock.isnot(None))))
+
+def release_expired_reservations(now=None, batch_size=500):
+    """Put the stock of expired reservations back, ``batch_size`` at a time.
+
+    Every batch is committed on its own so the sweeper never holds locks on
+    many products at once. Returns the number of reservations released.
+    """
+    now = now or datetime.utcnow()
+    released = 0
+    while True:
+        ids = db.session.scalars(select(StockReservation.id).where(StockReservation.expires_at <= now)
+                                 .order_by(StockReservation.id).limit(batch_size)).all()
+        if not ids:
+            break
+        released += release_reservations(StockReservation.id.in_(ids))
+        db.session.commit()
+        if len(ids) < batch_size:
+            break
+    return released
+
+@bp.cli.command('release-expired')
+def release_expired_command():
+    """Return the stock of expired reservations; run it from cron."""
+    released = release_expired_reservations(batch_size=current_app.config['STOCK_SWEEP_BATCH_SIZE'])
+    click.echo('Released %d expired reservations' % released)
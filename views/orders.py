@@ -0,0 +1,86 @@
+from flask import Blueprint, current_app, flash, redirect, render_template, stream_template, url_for
+from flask_login import current_user, login_required
+from sqlalchemy import delete, func, insert, literal, select, update
+
+from extensions import db, read_only
+from models import Cart, Order, OrderProduct, Product, StockReservation
+from views.cart import cart_lines, cart_total
+from views.inventory import OutOfStock, release_reservations, take_stock
+from views.outbox import enqueue_order_confirmation, wake_mailer
+
+bp = Blueprint('orders', __name__)
+
+def place_order(user_id):
+    """Turn a user's cart into an order without loading the cart.
+
+    The order header is inserted first, the cart lines are copied into
+    order_product with a single INSERT ... SELECT that snapshots each
+    product's current price, the header total is summed from those snapshots
+    and the cart is cleared with one DELETE, so the statement count does not
+    depend on the number of lines. Stock the user reserved at checkout is
+    released and taken again for the final quantities in the same
+    transaction. Returns the new Order, or None (after rolling back) when the
+    cart is empty; raises OutOfStock (after rolling back) when a product is
+    short. The caller commits.
+    """
+    order = Order(user_id=user_id)
+    db.session.add(order)
+    db.session.flush()
+
+    moved = db.session.execute(insert(OrderProduct).from_select(
+        ['order_id', 'product_id', 'quantity', 'unit_price'],
+        select(literal(order.id, db.Integer), Cart.product_id, Cart.quantity, Product.price)
+        .join(Cart.product).where(Cart.user_id == user_id).order_by(Cart.id)))
+    if moved.rowcount == 0:
+        db.session.rollback()
+        return None
+
+    release_reservations(StockReservation.user_id == user_id)
+    take_stock(user_id)
+    db.session.execute(update(Order).where(Order.id == order.id).values(total_price=(
+        select(func.round(func.sum(OrderProduct.unit_price * OrderProduct.quantity), 2))
+        .where(OrderProduct.order_id == order.id).scalar_subquery())))
+    db.session.execute(delete(Cart).where(Cart.user_id == user_id))
+    return order
+
+@bp.route('/review_order')
+@login_required
+@read_only
+def review_order():
+    user_cart = cart_lines(current_user.id)
+    total_price = cart_total(current_user.id)
+    return render_template('review_order.html', cart=user_cart, total_price=total_price)
+
+@bp.route('/confirm_order', methods=['POST'])
+@login_required
+def confirm_order():
+    try:
+        order = place_order(current_user.id)
+    except OutOfStock:
+        flash('Some products in your cart are out of stock. Update your cart and try again.', 'warning')
+        return redirect(url_for('orders.review_order'))
+    if order is None:
+        flash('Your cart is empty. Add products before confirming the order.', 'warning')
+        return redirect(url_for('orders.review_order'))
+
+    # The confirmation email is committed with the order and sent later, so
+    # checkout never waits on the mail server.
+    enqueue_order_confirmation(order, current_user)
+    db.session.commit()
+    wake_mailer()
+    flash('Order confirmed successfully! You will receive an email with order details.', 'success')
+    return redirect(url_for('catalog.index'))
+
+@bp.route('/orders')
+@login_required
+@read_only
+def orders():
+    # Orders are fetched in batches while the page streams, so memory and
+    # time to first byte do not grow with the customer's order history.
+    user_orders = db.session.execute(
+        select(Order.id, Order.created_at, Order.total_price)
+        .where(Order.user_id == current_user.id)
+        .order_by(Order.id.desc())
+        .execution_options(yield_per=current_app.config['STREAM_BATCH_SIZE'])
+    )
+    return current_app.response_class(stream_template('orders.html', orders=user_orders))
@@ -0,0 +1,151 @@
+import json
+import logging
+import smtplib
+import time
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+
+import click
+from flask import Blueprint, current_app, render_template
+from sqlalchemy import delete, select, update
+
+from extensions import db, mailer, metrics
+from models import Order, OutboxMessage
+
+bp = Blueprint('outbox', __name__)
+
+logger = logging.getLogger(__name__)
+
+outbox_messages = metrics.registry.counter(
+    'outbox_messages_total', 'Outbox messages the mailer tried to send.', ['outcome'])
+
+def enqueue_mail(recipient, subject, template, **payload):
+    """Add an email to the outbox. It is sent only if the caller commits."""
+    db.session.add(OutboxMessage(recipient=recipient, subject=subject, template=template,
+                                 payload=json.dumps(payload)))
+
+def enqueue_order_confirmation(order, user):
+    enqueue_mail(user.email, 'Your COZZY FITS order #%d' % order.id, 'email/order_confirmation.txt',
+                 order_id=order.id)
+
+def wake_mailer():
+    """Have this process's mailer thread send whatever is due now."""
+    if current_app.config['MAIL_SEND_IN_BACKGROUND']:
+        app = current_app._get_current_object()
+        mailer.start_worker(lambda: drain_in_context(app))
+
+def drain_in_context(app):
+    with app.app_context():
+        drain_outbox()
+
+def render_message(message):
+    context = json.loads(message.payload)
+    if 'order_id' in context:
+        context['order'] = db.session.get(Order, context['order_id'])
+    email = EmailMessage()
+    email['From'] = current_app.config['MAIL_SENDER']
+    email['To'] = message.recipient
+    email['Subject'] = message.subject
+    email.set_content(render_template(message.template, **context))
+    return email
+
+def retry_delay(attempts):
+    """Seconds to wait before attempt ``attempts + 1``: doubling, with a cap."""
+    config = current_app.config
+    return min(config['MAIL_RETRY_BACKOFF'] * 2 ** (attempts - 1), config['MAIL_RETRY_MAX_BACKOFF'])
+
+def claim_due_messages(now, batch_size):
+    """Lease up to ``batch_size`` due messages to this sender and return them.
+
+    The lease moves ``next_attempt_at`` past MAIL_CLAIM_TIMEOUT with a
+    conditional UPDATE, so concurrent senders claim disjoint batches, and a
+    sender that dies mid-batch leaves its messages to be retried later.
+    """
+    due = OutboxMessage.next_attempt_at <= now
+    lease = now + timedelta(seconds=current_app.config['MAIL_CLAIM_TIMEOUT'])
+    ids = db.session.scalars(
+        update(OutboxMessage)
+        .where(OutboxMessage.id.in_(select(OutboxMessage.id).where(due).order_by(OutboxMessage.id)
+                                    .limit(batch_size)), due)
+        .values(next_attempt_at=lease)
+        .returning(OutboxMessage.id)
+        .execution_options(synchronize_session=False)).all()
+    db.session.commit()
+    if not ids:
+        return []
+    return OutboxMessage.query.filter(OutboxMessage.id.in_(ids)).order_by(OutboxMessage.id).all()
+
+def send_outbox_batch(now=None):
+    """Send one batch of due messages over a single pooled connection.
+
+    Sent messages are deleted. A message that fails to render, one the
+    server refuses, and every message left when the connection fails are
+    retried after retry_delay(), until MAIL_MAX_ATTEMPTS is reached and the
+    message is kept unsent for inspection.
+    Returns the number of messages claimed.
+    """
+    config = current_app.config
+    now = now or datetime.utcnow()
+    messages = claim_due_messages(now, config['MAIL_BATCH_SIZE'])
+    if not messages:
+        return 0
+
+    sent, errors = [], {}
+    try:
+        with mailer.get_pool().connection() as smtp:
+            for message in messages:
+                # A message that cannot be rendered (its order was deleted,
+                # say) fails on its own instead of aborting the batch.
+                try:
+                    email = render_message(message)
+                except Exception as error:
+                    logger.exception('Rendering outbox message %d failed', message.id)
+                    errors[message.id] = error
+                    continue
+                try:
+                    smtp.send_message(email)
+                except smtplib.SMTPServerDisconnected:
+                    raise
+                except smtplib.SMTPException as error:
+                    errors[message.id] = error
+                else:
+                    sent.append(message.id)
+    except (smtplib.SMTPException, OSError) as error:
+        for message in messages:
+            if message.id not in sent:
+                errors.setdefault(message.id, error)
+
+    if sent:
+        db.session.execute(delete(OutboxMessage).where(OutboxMessage.id.in_(sent))
+                           .execution_options(synchronize_session=False))
+        outbox_messages.inc(len(sent), outcome='sent')
+    for message in messages:
+        if message.id in errors:
+            message.attempts += 1
+            message.last_error = str(errors[message.id])
+            if message.attempts < config['MAIL_MAX_ATTEMPTS']:
+                message.next_attempt_at = now + timedelta(seconds=retry_delay(message.attempts))
+                outbox_messages.inc(outcome='retry')
+            else:
+                message.next_attempt_at = None
+                outbox_messages.inc(outcome='failed')
+    db.session.commit()
+    return len(messages)
+
+def drain_outbox(now=None):
+    """Send batches until no message is due."""
+    while send_outbox_batch(now) == current_app.config['MAIL_BATCH_SIZE']:
+        pass
+
+@bp.cli.command('send')
+def send_command():
+    """Send every message that is due, then exit."""
+    drain_outbox()
+
+@bp.cli.command('worker')
+def worker_command():
+    """Keep sending due messages, polling every MAIL_POLL_INTERVAL seconds."""
+    click.echo('Sending mail from the outbox every %ss' % current_app.config['MAIL_POLL_INTERVAL'])
+    while True:
+        drain_outbox()
+        time.sleep(current_app.config['MAIL_POLL_INTERVAL'])
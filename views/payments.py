@@ -0,0 +1,136 @@
+import time
+import uuid
+from decimal import Decimal
+
+from flask import Blueprint, current_app, flash, jsonify, redirect, url_for
+from flask_login import current_user, login_required
+from sqlalchemy import select, update
+
+from extensions import db, metrics, payments
+from models import PaymentIntent, StockReservation
+from payments import PaymentError, QueueFull
+from views.cart import cart_lines
+from views.inventory import OutOfStock, release_reservations, reserve_stock
+
+bp = Blueprint('payments', __name__)
+
+payment_call_duration = metrics.registry.histogram(
+    'payment_gateway_call_duration_seconds', 'Time spent creating payments with the gateway.', ['outcome'])
+
+@bp.route('/checkout', methods=['POST'])
+@login_required
+def initiate_payment():
+    user_cart = cart_lines(current_user.id)
+    if not user_cart:
+        return jsonify({'error': 'Your cart is empty.'}), 400
+
+    items = [{
+        "name": item.product.name,
+        "sku": str(item.product.id),
+        "price": '%.2f' % item.product.price,
+        "currency": "USD",
+        "quantity": item.quantity
+    } for item in user_cart]
+    total_price = sum(Decimal(item['price']) * item['quantity'] for item in items)
+
+    # Set up the payment details for the gateway
+    payload = {
+        "intent": "sale",
+        "payer": {
+            "payment_method": "paypal",
+        },
+        "redirect_urls": {
+            "return_url": url_for('payments.payment_success', _external=True),
+            "cancel_url": url_for('payments.payment_cancel', _external=True),
+        },
+        "transactions": [{
+            "item_list": {
+                "items": items
+            },
+            "amount": {
+                "total": '%.2f' % total_price,
+                "currency" : "USD"
+            },
+            "description": "Payment for products"
+        }]
+    }
+
+    # The cart's stock is held while the customer pays; the reservation and
+    # the intent are committed together.
+    try:
+        reserve_stock(current_user.id, current_app.config['STOCK_RESERVATION_TTL'])
+    except OutOfStock as error:
+        return jsonify({'error': 'Some products are out of stock.', 'product_ids': error.product_ids}), 409
+
+    intent_id = uuid.uuid4().hex
+    db.session.add(PaymentIntent(id=intent_id, user_id=current_user.id, total_price=total_price))
+    db.session.commit()
+
+    # The gateway round trip happens on the payment queue; the client polls
+    # the intent for the PayPal approval URL.
+    app = current_app._get_current_object()
+    try:
+        payments.submit(create_gateway_payment, app, intent_id, payload)
+    except QueueFull:
+        record_payment_failure(app, intent_id, 'Payment queue is full.')
+        return jsonify({'intent_id': intent_id, 'status': 'failed'}), 503
+
+    return jsonify({
+        'intent_id': intent_id,
+        'status': 'pending',
+        'status_url': url_for('payments.payment_status', intent_id=intent_id),
+    }), 202
+
+def create_gateway_payment(app, intent_id, payload):
+    """Background job: create the gateway payment for an intent."""
+    started = time.perf_counter()
+    try:
+        with app.app_context():
+            gateway = payments.get_gateway()
+        result = gateway.create_payment(payload)
+    except PaymentError as error:
+        payment_call_duration.observe(time.perf_counter() - started, outcome='error')
+        record_payment_failure(app, intent_id, str(error))
+    else:
+        payment_call_duration.observe(time.perf_counter() - started, outcome='created')
+        record_payment_outcome(app, intent_id, status='created', payment_id=result.payment_id,
+                               approval_url=result.approval_url)
+
+def record_payment_outcome(app, intent_id, **values):
+    with app.app_context():
+        db.session.execute(update(PaymentIntent).where(PaymentIntent.id == intent_id).values(**values))
+        db.session.commit()
+
+def record_payment_failure(app, intent_id, error):
+    """Mark an intent failed and put its owner's reserved stock back on sale."""
+    with app.app_context():
+        owner = select(PaymentIntent.user_id).where(PaymentIntent.id == intent_id).scalar_subquery()
+        release_reservations(StockReservation.user_id == owner)
+        db.session.execute(update(PaymentIntent).where(PaymentIntent.id == intent_id)
+                           .values(status='failed', error=error))
+        db.session.commit()
+
+@bp.route('/payment/intents/<intent_id>')
+@login_required
+def payment_status(intent_id):
+    intent = PaymentIntent.query.filter_by(id=intent_id, user_id=current_user.id).first_or_404()
+    return jsonify({
+        'intent_id': intent.id,
+        'status': intent.status,
+        'redirect_url': intent.approval_url,
+        'error': intent.error,
+    })
+
+@bp.route('/payment/success')
+@login_required
+def payment_success():
+    flash('Payment approved. Confirm your order to complete the purchase.', 'success')
+    return redirect(url_for('orders.review_order'))
+
+@bp.route('/payment/cancel')
+@login_required
+def payment_cancel():
+    release_reservations(StockReservation.user_id == current_user.id)
+    db.session.commit()
+    flash('Payment canceled. Your order has not been processed.')
+    return redirect(url_for('orders.review_order'))
@@ -0,0 +1,4 @@
+"""WSGI entry point for production servers, e.g. ``gunicorn --preload wsgi:app``."""
+from application import create_app
+
+app = create_app()